@@ -0,0 +1,95 @@
+"""Agent runs that outlive the request that started them.
+
+ManyChat gives an external request about 10 seconds. When the agent is slower
+the handler answers "processing" and the reply is sent later through the
+ManyChat API. The run that is already in flight is kept (asyncio.shield) and
+its result delivered when it finishes, instead of starting the same run a
+second time and paying for it twice.
+
+AgentRuns also deduplicates: a repeated request for the same conversation and
+prompt while a run is in flight (ManyChat retries, double taps) joins that run
+instead of starting another. Worker threads cannot be interrupted, so a run
+exceeding AGENT_RUN_TIMEOUT is abandoned: it finishes in its thread but
+nothing is delivered.
+
+Counters and timings are recorded in `metrics` under `agent_runs`.
+"""
+import asyncio
+import logging
+import os
+import time
+
+import metrics
+from retrieval_cache import normalize_query
+
+logger = logging.getLogger(__name__)
+
+# Seconds a request waits for the agent before answering "processing"
+AGENT_RESPONSE_TIMEOUT = float(os.getenv("AGENT_RESPONSE_TIMEOUT", "9"))
+# Seconds after which a late run is abandoned instead of delivered
+AGENT_RUN_TIMEOUT = float(os.getenv("AGENT_RUN_TIMEOUT", "120"))
+
+
+class AgentRuns:
+    """Agent runs in flight, keyed by conversation and prompt."""
+
+    def __init__(self, run_timeout=AGENT_RUN_TIMEOUT):
+        self.run_timeout = run_timeout
+        self._runs = {}
+        self._deliveries = set()
+
+    def start(self, conversation_id, prompt, func, *args):
+        """Run func(*args) in a thread unless the same prompt is already running.
+
+        Returns (task, started), started being False for a duplicate.
+        """
+        key = (str(conversation_id), normalize_query(prompt))
+        task = self._runs.get(key)
+        if task is not None:
+            metrics.increment("agent_runs.duplicates")
+            logger.info(f"Joining in-flight agent run for {key[0]}")
+            return task, False
+        task = asyncio.ensure_future(asyncio.to_thread(func, *args))
+        task.started_at = time.perf_counter()
+        self._runs[key] = task
+        task.add_done_callback(lambda _: self._runs.pop(key, None))
+        metrics.increment("agent_runs.started")
+        return task, True
+
+    async def wait(self, task, timeout=AGENT_RESPONSE_TIMEOUT):
+        """Wait up to timeout for task; on timeout the run keeps going."""
+        return await asyncio.wait_for(asyncio.shield(task), timeout=timeout)
+
+    def deliver_later(self, task, deliver):
+        """Call await deliver(result) once task finishes, within run_timeout."""
+        metrics.increment("agent_runs.timeouts")
+        delivery = asyncio.create_task(self._deliver(task, deliver))
+        self._deliveries.add(delivery)
+        delivery.add_done_callback(self._deliveries.discard)
+        return delivery
+
+    async def _deliver(self, task, deliver):
+        remaining = self.run_timeout - (time.perf_counter() - task.started_at)
+        try:
+            result = await asyncio.wait_for(asyncio.shield(task), timeout=max(remaining, 0))
+        except asyncio.TimeoutError:
+            metrics.increment("agent_runs.abandoned")
+            logger.error(f"Agent run exceeded {self.run_timeout}s, reply not delivered")
+            return
+        except Exception as e:
+            metrics.increment("agent_runs.late_failures")
+            logger.error(f"Late agent run failed: {e}")
+            return
+        try:
+            await deliver(result)
+        except Exception as e:
+            metrics.increment("agent_runs.late_failures")
+            logger.error(f"Failed to deliver late agent reply: {e}")
+            return
+        metrics.increment("agent_runs.late_completions")
+        metrics.observe("agent_runs.late_latency_ms", (time.perf_counter() - task.started_at) * 1000)
+
+    def cancel_deliveries(self):
+        """Stop waiting for late runs, e.g. on shutdown."""
+        for delivery in list(self._deliveries):
+            delivery.cancel()
@@ -0,0 +1,260 @@
+"""Approximate nearest neighbour index types for the FAISS knowledge store.
+
+`FAISS.from_documents` builds a flat exact index, which is the right choice
+for a few thousand chunks. For the catalog-plus-transcripts corpus INDEX_TYPE
+selects an approximate index instead:
+
+* flat  - exact IndexFlatL2 (default)
+* ivf   - IndexIVFFlat with IVF_NLIST centroids trained on the chunk vectors,
+          searching IVF_NPROBE lists per query
+* hnsw  - IndexHNSWFlat graph with HNSW_M links, searching with HNSW_EF_SEARCH
+
+Recall against the exact index and query latency for a sweep of search
+parameters are reported by the commands below, followed by the end-to-end
+latency of HybridRetriever.search (vector search, BM25 and fusion), unscoped
+and scoped to a few courses:
+
+    python ann_index.py tune --index-type ivf
+    python ann_index.py tune --index-type hnsw --synthetic 100000
+"""
+import argparse
+import json
+import math
+import os
+import time
+
+import numpy as np
+
+INDEX_TYPE = os.getenv("INDEX_TYPE", "flat")
+IVF_NLIST = int(os.getenv("IVF_NLIST", "0"))  # 0 picks ~4 * sqrt(chunks)
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "8"))
+HNSW_M = int(os.getenv("HNSW_M", "32"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "80"))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "64"))
+# IVF needs enough points per centroid to train; smaller corpora stay flat
+MIN_TRAINING_POINTS_PER_LIST = 39
+
+
+def ivf_nlist(n_vectors):
+    """Number of IVF lists for n_vectors, 1 meaning IVF is not worth it."""
+    nlist = IVF_NLIST or int(4 * math.sqrt(n_vectors))
+    return max(1, min(nlist, n_vectors // MIN_TRAINING_POINTS_PER_LIST))
+
+
+def create_index(vectors, index_type=INDEX_TYPE):
+    """Build an empty (trained when needed) FAISS index for vectors."""
+    import faiss
+
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    dimension = vectors.shape[1]
+    if index_type == "ivf":
+        nlist = ivf_nlist(len(vectors))
+        if nlist > 1:
+            quantizer = faiss.IndexFlatL2(dimension)
+            index = faiss.IndexIVFFlat(quantizer, dimension, nlist)
+            index.train(vectors)
+            return apply_search_params(index)
+        index_type = "flat"
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dimension, HNSW_M)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        return apply_search_params(index)
+    if index_type == "flat":
+        return faiss.IndexFlatL2(dimension)
+    raise ValueError(f"Unknown index type: {index_type}")
+
+
+def apply_search_params(index, nprobe=IVF_NPROBE, ef_search=HNSW_EF_SEARCH):
+    """Set the query-time knobs, which are also re-applied after loading."""
+    if hasattr(index, "nprobe"):
+        index.nprobe = nprobe
+    if hasattr(index, "hnsw"):
+        index.hnsw.efSearch = ef_search
+    return index
+
+
+def build_faiss_store(documents, embeddings, index_type=INDEX_TYPE):
+    """Embed documents into a LangChain FAISS store backed by index_type."""
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    from langchain_community.vectorstores import FAISS
+
+    texts = [doc.page_content for doc in documents]
+    vectors = embeddings.embed_documents(texts)
+    index = create_index(np.array(vectors, dtype=np.float32), index_type)
+    vectorstore = FAISS(embedding_function=embeddings, index=index,
+                        docstore=InMemoryDocstore(), index_to_docstore_id={})
+    vectorstore.add_embeddings(list(zip(texts, vectors)),
+                               metadatas=[doc.metadata for doc in documents])
+    return vectorstore
+
+
+def _search_latencies(index, queries, k):
+    latencies = []
+    results = []
+    for query in queries:
+        start = time.perf_counter()
+        _, ids = index.search(query[None, :], k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        results.append(ids[0])
+    return results, latencies
+
+
+def evaluate(vectors, queries, index_type, k=6, params=None):
+    """Return recall@k against exact search and latency for each parameter value."""
+    import faiss
+
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    _, truth = exact.search(queries, k)
+
+    start = time.perf_counter()
+    index = create_index(vectors, index_type)
+    index.add(vectors)
+    build_seconds = time.perf_counter() - start
+
+    if params is None:
+        params = [1, 2, 4, 8, 16, 32] if index_type == "ivf" else [16, 32, 64, 128, 256]
+    report = []
+    for value in params:
+        if index_type == "ivf":
+            apply_search_params(index, nprobe=value)
+        elif index_type == "hnsw":
+            apply_search_params(index, ef_search=value)
+        results, latencies = _search_latencies(index, queries, k)
+        recall = np.mean([len(set(found) & set(expected)) / k
+                          for found, expected in zip(results, truth)])
+        report.append({
+            "nprobe" if index_type == "ivf" else "ef_search": value,
+            f"recall@{k}": round(float(recall), 4),
+            "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+            "p99_ms": round(float(np.percentile(latencies, 99)), 3),
+        })
+        if index_type == "flat":
+            break
+    return {"index_type": index_type, "vectors": len(vectors),
+            "build_seconds": round(build_seconds, 2), "results": report}
+
+
+def evaluate_retriever(vectors, documents, queries, query_texts, index_type,
+                       scopes=(), embeddings=None):
+    """Return HybridRetriever.search latency over the corpus, unscoped and per course scope."""
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    from langchain_community.vectorstores import FAISS
+
+    from hybrid_retriever import HybridRetriever, course_scope_filter
+
+    index = create_index(vectors, index_type)
+    vectorstore = FAISS(embedding_function=embeddings, index=index,
+                        docstore=InMemoryDocstore(), index_to_docstore_id={})
+    vectorstore.add_embeddings(list(zip([doc.page_content for doc in documents], vectors)),
+                               metadatas=[doc.metadata for doc in documents])
+    start = time.perf_counter()
+    retriever = HybridRetriever.from_vectorstore(vectorstore)
+    build_seconds = time.perf_counter() - start
+
+    report = []
+    for scope in [None, *scopes]:
+        metadata_filter = course_scope_filter(scope) if scope else None
+        latencies = []
+        for query, text in zip(queries, query_texts):
+            start = time.perf_counter()
+            retriever.search(text, embedding=query.tolist(), metadata_filter=metadata_filter)
+            latencies.append((time.perf_counter() - start) * 1000)
+        report.append({
+            "scope": scope or "all",
+            "first_ms": round(latencies[0], 3),
+            "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+            "p99_ms": round(float(np.percentile(latencies, 99)), 3),
+        })
+    return {"bm25_build_seconds": round(build_seconds, 2), "results": report}
+
+
+def _synthetic_documents(labels, rng, words_per_document=20):
+    """Texts drawn from a per-cluster vocabulary; half are course chunks of 20 courses."""
+    from langchain_core.documents import Document
+
+    documents = []
+    for label in labels:
+        words = [f"w{label}_{j}" for j in rng.integers(30, size=words_per_document // 2)]
+        words += [f"w{j}" for j in rng.integers(1000, size=words_per_document - len(words))]
+        if label % 2:
+            metadata = {"doc_type": "course", "course_slug": f"curso-{label % 20}"}
+        else:
+            metadata = {"doc_type": "faq"}
+        documents.append(Document(page_content=" ".join(words), metadata=metadata))
+    return documents
+
+
+def _tune_command(args):
+    rng = np.random.default_rng(0)
+    if args.synthetic:
+        from langchain_core.embeddings import FakeEmbeddings
+
+        dimension = args.dimension
+        # Clustered points: real embeddings are far from uniformly spread, and
+        # uniform random vectors have no neighbourhood structure to recall
+        centers = rng.standard_normal((max(1, args.synthetic // 100), dimension)).astype(np.float32)
+        labels = rng.integers(len(centers), size=args.synthetic)
+        vectors = centers[labels] + 0.5 * rng.standard_normal((args.synthetic, dimension)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        # Queries near existing points, like real questions near their answers
+        picks = rng.choice(len(vectors), size=args.queries, replace=False)
+        queries = vectors[picks] + 0.05 * rng.standard_normal((args.queries, dimension)).astype(np.float32)
+        documents = _synthetic_documents(labels, rng)
+        query_texts = [" ".join(documents[pick].page_content.split()[:5]) for pick in picks]
+        scopes = ["curso-1", "curso-3"]
+        # Queries are searched by vector, so the store never embeds anything
+        embeddings = FakeEmbeddings(size=dimension)
+    else:
+        from ingestion import load_knowledge_documents
+        from knowledge_index import get_embeddings, split_documents
+        from vector_stores import SAMPLE_QUERIES
+
+        embeddings, _ = get_embeddings()
+        splits = split_documents(load_knowledge_documents(args.sources), splitter="structured")
+        vectors = np.array(embeddings.embed_documents([doc.page_content for doc in splits]),
+                           dtype=np.float32)
+        queries = np.array([embeddings.embed_query(query) for query in SAMPLE_QUERIES],
+                           dtype=np.float32)
+        documents = splits
+        query_texts = SAMPLE_QUERIES
+        scopes = sorted({doc.metadata["course_slug"] for doc in splits
+                         if doc.metadata.get("course_slug")})[:3]
+    vectors = np.ascontiguousarray(vectors)
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    report = evaluate(vectors, queries, args.index_type, k=args.k)
+    report["retriever"] = evaluate_retriever(vectors, documents, queries, query_texts,
+                                             args.index_type, scopes, embeddings)
+    print(json.dumps(report, indent=2))
+
+
+def _build_command(args):
+    from ingestion import create_knowledge_base
+    from knowledge_index import get_embeddings
+
+    embeddings, embedding_model = get_embeddings()
+    knowledge = create_knowledge_base(embeddings, embedding_model, sources=args.sources)
+    knowledge.build()
+    print(json.dumps({"index_type": INDEX_TYPE, "version": knowledge.version}))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="FAISS ANN index tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build = subparsers.add_parser("build", help="build and persist the knowledge index (uses INDEX_TYPE)")
+    build.add_argument("--sources", nargs="+", default=None)
+    build.set_defaults(func=_build_command)
+
+    tune = subparsers.add_parser("tune", help="report recall and latency per search parameter")
+    tune.add_argument("--index-type", choices=["flat", "ivf", "hnsw"], default=INDEX_TYPE)
+    tune.add_argument("--k", type=int, default=6)
+    tune.add_argument("--sources", nargs="+", default=None)
+    tune.add_argument("--synthetic", type=int, default=0,
+                      help="use N random vectors instead of the knowledge base")
+    tune.add_argument("--dimension", type=int, default=768)
+    tune.add_argument("--queries", type=int, default=200)
+    tune.set_defaults(func=_tune_command)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -1,24 +1,30 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header
 from pydantic import BaseModel, Field
 from langchain_openai import ChatOpenAI
 from langchain_core.tools import tool
 from langchain.agents import AgentExecutor, create_openai_tools_agent
 from langchain_core.prompts import FewShotChatMessagePromptTemplate, ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.messages import AIMessage, HumanMessage
-from langchain_community.document_loaders import TextLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from langchain_community.vectorstores import FAISS
+from langchain_community.callbacks import get_openai_callback
 from fastapi.middleware.cors import CORSMiddleware
 import requests
 import httpx
 import os
 import json
+import time
+from typing import Optional
 from dotenv import load_dotenv
 import logging
 from cachetools import TTLCache
 import asyncio
 from fastapi import BackgroundTasks
+import metrics
+from catalog import asks_for_catalog, catalog_text, course_index, detect_course_slug, needs_catalog
+from ingestion import create_knowledge_base
+from knowledge_index import CATALOG_ONLY_CONTEXT, get_embeddings
+from agent_runs import AGENT_RESPONSE_TIMEOUT, AgentRuns
+from streaming_json import deliver_stream
+from sales_notes import SalesNotes, internal_notes_instructions
 
 # Load environment variables
 load_dotenv()
@@ -48,6 +54,8 @@ class UserQuery(BaseModel):
     subscriber_id: int
     channel: str
     prompt: str
+    course_slug: str = Field(default=None,
+                             description="Optional slug of the course being discussed")
 
 
 #BotConversa
@@ -62,6 +70,8 @@ class RequestBodyBotConversa(BaseModel):
     subscriber_id: str = Field(default=None,
                                description="Optional Subscriber ID")
     prompt: str
+    course_slug: str = Field(default=None,
+                             description="Optional slug of the course being discussed")
 
 def get_phone_url(phone: str) -> str:
     return f"{os.getenv('BOTCONVERSA_URL')}/subscriber/get_by_phone/{phone}/"
@@ -74,17 +84,27 @@ def send_message_url(subscriber_id: str) -> str:
 global_context = ""
 chat_history = {}
 chat_history['user_id'] = []
-
-loader = TextLoader("./rag.txt", encoding="UTF-8")
-docs = loader.load()
-
-text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000,
-                                               chunk_overlap=200)
-all_splits = text_splitter.split_documents(docs)
-embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
-vectorstore = FAISS.from_documents(documents=all_splits, embedding=embeddings)
-retriever = vectorstore.as_retriever(search_type="similarity",
-                                     search_kwargs={"k": 6})
+# Course each conversation is currently about, used to scope retrieval
+active_courses = TTLCache(maxsize=10000, ttl=24 * 3600)
+
+embeddings, embedding_model = get_embeddings()
+# The index is built by a startup task; until then /chat answers from the catalog only
+knowledge = create_knowledge_base(embeddings, embedding_model, k=4,
+                                  degraded_context=CATALOG_ONLY_CONTEXT)
+# Agent runs in flight; slow ones are delivered late through ManyChat
+agent_runs = AgentRuns()
+MANYCHAT_SEND_CONTENT_URL = "https://api.manychat.com/fb/sending/sendContent"
+# Send each message as soon as the model has written it instead of the whole reply at the end
+STREAM_REPLIES = os.getenv("STREAM_REPLIES", "false").lower() in ("1", "true")
+# Streamed replies whose messages are sent but whose internal notes are still being written
+streaming_replies = set()
+# "agent": the agent fetches courses with a tool; "single_pass": the catalog is
+# put in the prompt when the question needs it and one LLM call answers
+ANSWER_MODE = os.getenv("ANSWER_MODE", "agent")
+# Latest sales-funnel notes per subscriber (INTERNAL_NOTES_MODE)
+sales_notes = SalesNotes()
+# Seconds between checks of the knowledge files for changes (0 disables the watcher)
+KNOWLEDGE_WATCH_INTERVAL = int(os.getenv("KNOWLEDGE_WATCH_INTERVAL", "30"))
 
 # Cache com tempo de vida de 1 hora (3600 segundos)
 course_cache = TTLCache(maxsize=1, ttl=3600)
@@ -109,17 +129,100 @@ async def update_courses_periodically():
 async def startup_event():
     """Run tasks on startup."""
     asyncio.create_task(update_courses_periodically())
+    asyncio.create_task(sales_notes.run())
+    asyncio.create_task(knowledge.build_in_background())
+    if KNOWLEDGE_WATCH_INTERVAL > 0:
+        asyncio.create_task(knowledge.watch_sources(KNOWLEDGE_WATCH_INTERVAL))
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop waiting for late agent replies."""
+    agent_runs.cancel_deliveries()
+    for reply in list(streaming_replies):
+        reply.cancel()
+
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness probe: the process is up and serving."""
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness probe: the knowledge index has been built."""
+    if not knowledge.ready:
+        raise HTTPException(status_code=503,
+                            detail=knowledge.error or "Knowledge index is still building")
+    return {"status": "ready"}
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Per-process counters, timings and cache hit rates."""
+    return {
+        **metrics.snapshot(),
+        "hit_rates": {
+            "query_embedding_cache": metrics.hit_rate("query_embedding_cache"),
+            "retrieval_cache": metrics.hit_rate("retrieval_cache"),
+        },
+        "knowledge_index_version": knowledge.version,
+    }
+
+
+@app.post("/admin/reload")
+async def admin_reload(x_admin_token: str = Header(default="")):
+    """Rebuild the knowledge index in the background and swap it in."""
+    if not os.getenv("ADMIN_TOKEN") or x_admin_token != os.getenv("ADMIN_TOKEN"):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+    asyncio.create_task(knowledge.reload())
+    asyncio.create_task(fetch_courses_async())
+    return {"status": "reloading"}
+
+
+@app.get("/admin/notes/{subscriber_id}")
+async def admin_notes(subscriber_id: str, x_admin_token: str = Header(default="")):
+    """Latest sales-funnel notes for a subscriber."""
+    if not os.getenv("ADMIN_TOKEN") or x_admin_token != os.getenv("ADMIN_TOKEN"):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+    return {"subscriber_id": subscriber_id, "internal_notes": sales_notes.get(subscriber_id)}
+
+def resolve_course_slug(conversation_id, prompt, course_slug=None):
+    """Pick the course a turn is about: explicit slug, mentioned course or the previous one."""
+    course_slug = (course_slug
+                   or detect_course_slug(prompt, course_cache.get('courses', []))
+                   or active_courses.get(conversation_id))
+    if course_slug:
+        active_courses[conversation_id] = course_slug
+    return course_slug
 
 # Define tools
 @tool
-def get_courses() -> str:
-    """Get available courses from the cache."""
+def search_courses(name: Optional[str] = None, level: Optional[str] = None,
+                   max_price: Optional[float] = None, fields: Optional[str] = None) -> str:
+    """Search the available courses; with no arguments, list them all.
+
+    name: words of the course name, e.g. "power bi". level: Básico, Intermédio
+    or Avançado. max_price: highest price in Kz. fields: comma-separated fields
+    to return, from name, level, price, location, address, duration, dates,
+    schedule, requirements, audience, topics, description, image (default:
+    name, level, price, location, dates, schedule).
+    Returns one line per course.
+    """
     if 'courses' not in course_cache:
         asyncio.run(fetch_courses_async())
-    return course_cache['courses']
+    index = course_index(course_cache['courses'])
+    results = index.search(name=name, level=level, max_price=max_price)
+    metrics.increment("search_courses.calls")
+    if not results:
+        return "Nenhum curso encontrado com esses filtros."
+    if fields:
+        return index.format(results, [field.strip() for field in fields.split(",")])
+    return index.format(results)
 
 # List of tools
-tools = [get_courses]
+tools = [search_courses]
 #
 
 example_output = {
@@ -543,10 +646,21 @@ response_examples_botconversa_json = json.dumps(response_examples_botconversa,
                                                 ensure_ascii=False,
                                                 indent=4)
 
+# How the reply prompt gets the courses in each ANSWER_MODE
+SEARCH_COURSES_INSTRUCTIONS = """When responding to user queries, you may need to look up courses using the `search_courses` tool: call it without arguments to list every available course, or filter by name, level or max_price, and ask only for the fields you need (e.g. "name,price,dates", or "image" for the course picture). if asked about available courses send all the courses return by `search_courses` tool, if more than 10 courses you need to send multiple messages (multiple card on facebook and instagram)."""
+CATALOG_INSTRUCTIONS = """These are the courses currently available. if asked about available courses send all of them, if more than 10 courses you need to send multiple messages (multiple card on facebook and instagram).
+<courses>
+{catalog}
+</courses>"""
+COURSE_INSTRUCTIONS = """This is the course the customer is talking about:
+<course>
+{catalog}
+</course>"""
+
 # Define system prompt with dynamic examples
 qa_system_prompt = """"You are Ada, an exceptional AI sales representative for Buka, an edtech startup dedicated to transforming lives through education. Your persona blends the persuasive skills of Jordan Belfort, the inspirational approach of Simon Sinek, and the visionary spirit of Steve Jobs. Your task is to engage with potential customers and effectively sell courses.
 
-When responding to user queries, you may need to fetch available courses using the `get_courses` tool. if asked about available courses send all the courses return by `get_courses` tool, if more than 10 courses you need to send multiple messages (multiple card on facebook and instagram).
+{courses_instructions}
 
 
 Here is some example of how you will respond:
@@ -597,7 +711,7 @@ Never send image links, always send files, images, cards, and other types that a
 Your response should be structured as JSON containing:
 - `channel`: The communication channel (provided below).
 - `messages`: An array of messages to be sent, with each message in the appropriate format for the platform.
-- `internal_notes`: Estágio do Funil de Vendas: [Current stage], Insights Importantes do Cliente: [Key customer information], Próximos Passos: [Suggested follow-up actions]
+{internal_notes_instructions}
 
 use the dynamic_block_docs and the examples we showed you ealier to garantee that your messages array and it's children are structured in a way that is compatible with the platform.
 
@@ -626,17 +740,136 @@ qa_prompt = ChatPromptTemplate.from_messages([
     MessagesPlaceholder(variable_name="chat_history"),
     ("human", "{input}"),
     MessagesPlaceholder(variable_name="agent_scratchpad"),
-])
+]).partial(internal_notes_instructions=internal_notes_instructions())
 
 # Create the agent and bind the tools
 agent = create_openai_tools_agent(llm, tools, prompt=qa_prompt)
 agent_executor = AgentExecutor(agent=agent, tools=tools, verbose=True)
 
+# The same prompt without tools, answered by a single LLM call
+single_pass_chain = ChatPromptTemplate.from_messages([
+    ("system", qa_system_prompt),
+    MessagesPlaceholder(variable_name="chat_history"),
+    ("human", "{input}"),
+]).partial(internal_notes_instructions=internal_notes_instructions()) | llm
+
+async def courses_instructions(prompt, course_slug=None):
+    """The course part of the reply prompt for ANSWER_MODE."""
+    if ANSWER_MODE != "single_pass":
+        return SEARCH_COURSES_INSTRUCTIONS
+    if not needs_catalog(prompt, course_slug):
+        metrics.increment("answer.catalog_skipped")
+        return ""
+    if 'courses' not in course_cache:
+        await fetch_courses_async()
+    # The active course sticks to the conversation; the whole catalog is only
+    # sent when the question is about the offer
+    if course_slug and not asks_for_catalog(prompt):
+        catalog = catalog_text(course_cache['courses'], course_slug=course_slug)
+        if catalog:
+            metrics.increment("answer.course_injected")
+            return COURSE_INSTRUCTIONS.format(catalog=catalog)
+    catalog = catalog_text(course_cache['courses'])
+    if not catalog:
+        return ""
+    metrics.increment("answer.catalog_injected")
+    return CATALOG_INSTRUCTIONS.format(catalog=catalog)
+
+def answer(agent_input):
+    """Answer agent_input in ANSWER_MODE, returning {"output": reply JSON}.
+
+    Latency, tokens and LLM calls are recorded per mode under answer.<mode>
+    in /metrics, to compare the two.
+    """
+    start = time.perf_counter()
+    with get_openai_callback() as usage:
+        if ANSWER_MODE == "single_pass":
+            response = {"output": single_pass_chain.invoke(agent_input).content}
+        else:
+            response = agent_executor.invoke(agent_input)
+    metrics.observe(f"answer.{ANSWER_MODE}.latency_ms", (time.perf_counter() - start) * 1000)
+    metrics.observe(f"answer.{ANSWER_MODE}.prompt_tokens", usage.prompt_tokens)
+    metrics.observe(f"answer.{ANSWER_MODE}.completion_tokens", usage.completion_tokens)
+    metrics.observe(f"answer.{ANSWER_MODE}.llm_calls", usage.successful_requests)
+    return response
+
+async def send_manychat_content(subscriber_id, channel, messages):
+    """Send messages to a subscriber through the ManyChat API; True on success."""
+    headers = {
+        "Authorization": f"Bearer {os.getenv('MANYCHAT_API_KEY')}",
+        "Content-Type": "application/json"
+    }
+    payload = {
+        "subscriber_id": subscriber_id,
+        "data": {
+            "version": "v2",
+            "content": {
+                "type": channel,
+                "messages": messages,
+            }
+        },
+        "message_tag": "ACCOUNT_UPDATE",
+    }
+    async with httpx.AsyncClient() as client:
+        manychat_response = await client.post(MANYCHAT_SEND_CONTENT_URL, headers=headers, json=payload)
+    if manychat_response.status_code != 200:
+        logger.error(f"Failed to send messages via ManyChat API: {manychat_response.text}")
+        return False
+    return True
+
+async def agent_output_chunks(agent_input):
+    """Text of the agent's final answer, as the model streams it."""
+    if ANSWER_MODE == "single_pass":
+        async for chunk in single_pass_chain.astream(agent_input):
+            if chunk.content:
+                yield chunk.content
+        return
+    async for event in agent_executor.astream_events(agent_input, version="v2"):
+        # Tool-calling turns stream tool call chunks with empty content
+        if event["event"] == "on_chat_model_stream" and event["data"]["chunk"].content:
+            yield event["data"]["chunk"].content
+
+def record_reply(conversation_id, prompt, output):
+    """Add the agent's reply to the chat history and keep its sales notes."""
+    chat_history["user_id"].append(AIMessage(content=output))
+    sales_notes.record(conversation_id, prompt, output)
+
+async def stream_reply(conversation_id, agent_input, send, timeout=None):
+    """Run the agent, awaiting send(message) for each message as soon as it is written.
+
+    Returns once every message is sent (or after timeout, the rest being sent
+    as it comes); the internal notes and the chat history update finish in
+    the background.
+    """
+    messages_sent = asyncio.Event()
+
+    async def run():
+        output = await deliver_stream(agent_output_chunks(agent_input), send, messages_sent)
+        record_reply(conversation_id, agent_input["input"], output)
+
+    def log_failure(task):
+        # Failures after stream_reply returned have no one else to report them
+        if not task.cancelled() and task.exception():
+            metrics.increment("streaming.failures")
+            logger.error(f"Streamed reply failed: {task.exception()}")
+
+    reply = asyncio.create_task(run())
+    streaming_replies.add(reply)
+    reply.add_done_callback(streaming_replies.discard)
+    reply.add_done_callback(log_failure)
+    try:
+        await asyncio.wait_for(messages_sent.wait(), timeout=timeout)
+    except asyncio.TimeoutError:
+        logger.info("Reply still streaming, the remaining messages are sent as they come")
+    if reply.done() and not reply.cancelled() and reply.exception():
+        raise reply.exception()
+
 @app.post("/chat")
 async def handle_query(user_query: UserQuery):
-    # Prepare the input for the agent
-    context_docs = retriever.get_relevant_documents(user_query.prompt)
-    context = "\n".join([doc.page_content for doc in context_docs])
+    # Prepare the input for the agent, searching the active course plus the general FAQ
+    course_slug = resolve_course_slug(user_query.subscriber_id, user_query.prompt,
+                                      user_query.course_slug)
+    context = await knowledge.aget_context(user_query.prompt, course_slug=course_slug)
 
     agent_input = {
         "input": user_query.prompt,
@@ -644,91 +877,104 @@ async def handle_query(user_query: UserQuery):
         "context": context,
         "response_examples_json": response_examples_json,
         "channel": user_query.channel,
+        "courses_instructions": await courses_instructions(user_query.prompt, course_slug),
     }
 
-    # Handle synchronous invoke
-    try:
-        response = await asyncio.wait_for(
-            asyncio.to_thread(agent_executor.invoke, agent_input),
-            timeout=9
-        )
-        response_json = json.loads(response["output"])
-        messages = response_json.get("messages", [])
-
-        chat_history["user_id"].append(AIMessage(content=response["output"]))
+    if STREAM_REPLIES:
+        async def send(message):
+            if not await send_manychat_content(user_query.subscriber_id, user_query.channel, [message]):
+                raise RuntimeError("ManyChat rejected a streamed message")
+
+        try:
+            await stream_reply(user_query.subscriber_id, agent_input, send,
+                               timeout=AGENT_RESPONSE_TIMEOUT)
+        except Exception as e:
+            logger.error(f"Streamed reply failed: {e}")
+            raise HTTPException(status_code=500, detail="Failed to send messages via ManyChat API.")
+        # Every message went out through the ManyChat API already
         return {
                 "version": "v2",
                 "content": {
                     "type": user_query.channel,
-                    "messages": messages,
-                }
-        }
-    except asyncio.TimeoutError:
-        # If the operation takes more than 9 seconds, send via ManyChat API
-        # Send a temporary processing message via ManyChat API
-        processing_message = "...processando... pode levar mais tempo que o habitual."
-        manychat_api_url = f"https://api.manychat.com/fb/sending/sendContent"
-        headers = {
-            "Authorization": f"Bearer {os.getenv('MANYCHAT_API_KEY')}",
-            "Content-Type": "application/json"
-        }
-        payload = {
-            "subscriber_id": user_query.subscriber_id,
-            "data": {
-                "version": "v2",
-                "content": {
-                    "type": user_query.channel,
-                    "messages": [{
-                        "type": "text",
-                        "text": processing_message
-                    }],
+                    "messages": [],
                 }
-            },
-            "message_tag": "ACCOUNT_UPDATE",
         }
 
-        async with httpx.AsyncClient() as client:
-            manychat_response = await client.post(manychat_api_url, headers=headers, json=payload)
-            if manychat_response.status_code != 200:
-                logging.error(f"Failed to send processing message via ManyChat API: {manychat_response.text}")
-                raise HTTPException(status_code=500, detail="Failed to send processing message via ManyChat API.")
+    task, started = agent_runs.start(user_query.subscriber_id, user_query.prompt,
+                                     answer, agent_input)
+    if not started:
+        # A retry of a request still being answered; the first one delivers the reply
+        return {"status": "processing"}
 
-        #now process the ai response
-        response = await asyncio.to_thread(agent_executor.invoke, agent_input)
+    try:
+        response = await agent_runs.wait(task)
         response_json = json.loads(response["output"])
         messages = response_json.get("messages", [])
-        chat_history["user_id"].append(AIMessage(content=response["output"]))
-        manychat_api_url = f"https://api.manychat.com/fb/sending/sendContent"
-        headers = {
-            "Authorization": f"Bearer {os.getenv('MANYCHAT_API_KEY')}",
-            "Content-Type": "application/json"
-        }
-        payload = {
-            "subscriber_id": user_query.subscriber_id,
-            "data": {
+
+        record_reply(user_query.subscriber_id, user_query.prompt, response["output"])
+        return {
                 "version": "v2",
                 "content": {
                     "type": user_query.channel,
                     "messages": messages,
                 }
-            },
-            "message_tag": "ACCOUNT_UPDATE",
         }
+    except asyncio.TimeoutError:
+        # The run keeps going; tell the user and deliver its reply through ManyChat
+        processing_message = "...processando... pode levar mais tempo que o habitual."
+        if not await send_manychat_content(user_query.subscriber_id, user_query.channel,
+                                           [{"type": "text", "text": processing_message}]):
+            raise HTTPException(status_code=500, detail="Failed to send processing message via ManyChat API.")
 
-        # Use httpx for async request
-        async with httpx.AsyncClient() as client:
-            manychat_response = await client.post(manychat_api_url, headers=headers, json=payload)
-            if manychat_response.status_code != 200:
-                logging.error(f"Failed to send messages via ManyChat API: {manychat_response.text}")
-                raise HTTPException(status_code=500, detail="Failed to send messages via ManyChat API.")
+        async def deliver(response):
+            messages = json.loads(response["output"]).get("messages", [])
+            record_reply(user_query.subscriber_id, user_query.prompt, response["output"])
+            if not await send_manychat_content(user_query.subscriber_id, user_query.channel, messages):
+                raise RuntimeError("ManyChat rejected the late reply")
+
+        agent_runs.deliver_later(task, deliver)
         return {"status": "processing"}
 
 
+async def botconversa_subscriber_id(user_query):
+    """The BotConversa subscriber of a request, looked up by phone if not given."""
+    subscriber_id = user_query.subscriber_id
+    if not subscriber_id:
+        async with httpx.AsyncClient() as client:
+            response = await client.get(get_phone_url(user_query.phone),
+                                        headers=headersBotConversa)
+            response.raise_for_status()
+            subscriber_id = response.json().get('id')
+    if not subscriber_id:
+        raise HTTPException(status_code=404,
+                            detail="Subscriber ID not found")
+    return subscriber_id
+
+async def send_botconversa_message(client, subscriber_id, message):
+    """Send one text or file message to a BotConversa subscriber."""
+    message_type = message.get("type")
+    if message_type not in ["text", "file"]:
+        raise ValueError(
+            "Invalid message type. Only 'text' and 'file' are allowed."
+        )
+
+    message_data = {
+        "type": message_type,
+        "value":
+        message["value"]  # Send the provided value directly
+    }
+    send_response = await client.post(
+        send_message_url(subscriber_id),
+        json=message_data,
+        headers=headersBotConversa)
+    send_response.raise_for_status()
+
 @app.post("/chat/botconversa")
 async def send_message(user_query: RequestBodyBotConversa):
-    # Prepare the input for the agent
-    context_docs = retriever.get_relevant_documents(user_query.prompt)
-    context = "\n".join([doc.page_content for doc in context_docs])
+    # Prepare the input for the agent, searching the active course plus the general FAQ
+    course_slug = resolve_course_slug(user_query.phone, user_query.prompt,
+                                      user_query.course_slug)
+    context = await knowledge.aget_context(user_query.prompt, course_slug=course_slug)
 
     agent_input = {
         "input": user_query.prompt,
@@ -736,52 +982,40 @@ async def send_message(user_query: RequestBodyBotConversa):
         "context": context,
         "response_examples_json": response_examples_botconversa_json,
         "channel": "whatsapp",
+        "courses_instructions": await courses_instructions(user_query.prompt, course_slug),
     }
 
-    # Use the agent executor to get the response
-    response = agent_executor.invoke(agent_input)
+    if STREAM_REPLIES:
+        try:
+            subscriber_id = await botconversa_subscriber_id(user_query)
+            # The reply is added to the history in the background, so the
+            # question goes in now; the agent gets the history without it
+            agent_input["chat_history"] = list(chat_history["user_id"])
+            chat_history["user_id"].append(HumanMessage(content=user_query.prompt))
+            async with httpx.AsyncClient() as client:
+                await stream_reply(
+                    user_query.phone, agent_input,
+                    lambda message: send_botconversa_message(client, subscriber_id, message))
+            return {"success": True, "subscriber_id": subscriber_id}
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    # Use the agent executor (or the single-pass chain) to get the response
+    response = answer(agent_input)
 
     try:
         response_json = json.loads(response["output"])
         chat_history["user_id"].append(HumanMessage(content=user_query.prompt))
-        chat_history["user_id"].append(AIMessage(content=response["output"]))
+        record_reply(user_query.phone, user_query.prompt, response["output"])
         messages = response_json.get("messages", [])
         print(messages)
 
-        # Construct the ManyChat API endpoint
-        subscriber_id = user_query.subscriber_id
-
-        # If subscriber_id is not provided, fetch it using the phone number
-        if not subscriber_id:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(get_phone_url(user_query.phone),
-                                            headers=headersBotConversa)
-                response.raise_for_status()
-                subscriber_id = response.json().get('id')
-
-        if not subscriber_id:
-            raise HTTPException(status_code=404,
-                                detail="Subscriber ID not found")
+        subscriber_id = await botconversa_subscriber_id(user_query)
 
         # Send each message in the array one at a time
         async with httpx.AsyncClient() as client:
             for message in messages:
-                message_type = message.get("type")
-                if message_type not in ["text", "file"]:
-                    raise ValueError(
-                        "Invalid message type. Only 'text' and 'file' are allowed."
-                    )
-
-                message_data = {
-                    "type": message_type,
-                    "value":
-                    message["value"]  # Send the provided value directly
-                }
-                send_response = await client.post(
-                    send_message_url(subscriber_id),
-                    json=message_data,
-                    headers=headersBotConversa)
-                send_response.raise_for_status()
+                await send_botconversa_message(client, subscriber_id, message)
 
         return {"success": True, "subscriber_id": subscriber_id}
 
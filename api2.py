@@ -1,14 +1,10 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header
 from pydantic import BaseModel, Field
 from langchain_openai import ChatOpenAI
 from langchain_core.tools import tool
 from langchain.agents import AgentExecutor, create_openai_tools_agent
 from langchain_core.prompts import FewShotChatMessagePromptTemplate, ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.messages import AIMessage, HumanMessage
-from langchain_community.document_loaders import TextLoader,WebBaseLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from langchain_community.vectorstores import FAISS
 from fastapi.middleware.cors import CORSMiddleware
 import requests
 import httpx
@@ -16,6 +12,10 @@ import os
 import json
 from dotenv import load_dotenv
 import logging
+import asyncio
+import metrics
+from ingestion import create_knowledge_base
+from knowledge_index import CATALOG_ONLY_CONTEXT, get_embeddings
 
 # Load environment variables
 load_dotenv()
@@ -72,17 +72,57 @@ global_context = ""
 chat_history = {}
 chat_history['user_id'] = []
 
-#loader = TextLoader("./rag.txt", encoding="UTF-8")
-loader=WebBaseLoader('https://backend-produc.herokuapp.com/api/v1/cursos')
-docs = loader.load()
+embeddings, embedding_model = get_embeddings()
+# The index is built by a startup task; until then /chat answers without retrieval
+knowledge = create_knowledge_base(embeddings, embedding_model, k=4,
+                                  degraded_context=CATALOG_ONLY_CONTEXT)
+# Seconds between checks of the knowledge files for changes (0 disables the watcher)
+KNOWLEDGE_WATCH_INTERVAL = int(os.getenv("KNOWLEDGE_WATCH_INTERVAL", "30"))
+
+
+@app.on_event("startup")
+async def startup_event():
+    """Run tasks on startup."""
+    asyncio.create_task(knowledge.build_in_background())
+    if KNOWLEDGE_WATCH_INTERVAL > 0:
+        asyncio.create_task(knowledge.watch_sources(KNOWLEDGE_WATCH_INTERVAL))
+
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness probe: the process is up and serving."""
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness probe: the knowledge index has been built."""
+    if not knowledge.ready:
+        raise HTTPException(status_code=503,
+                            detail=knowledge.error or "Knowledge index is still building")
+    return {"status": "ready"}
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Per-process counters, timings and cache hit rates."""
+    return {
+        **metrics.snapshot(),
+        "hit_rates": {
+            "query_embedding_cache": metrics.hit_rate("query_embedding_cache"),
+            "retrieval_cache": metrics.hit_rate("retrieval_cache"),
+        },
+        "knowledge_index_version": knowledge.version,
+    }
+
 
-text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000,
-                                               chunk_overlap=200)
-all_splits = text_splitter.split_documents(docs)
-embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
-vectorstore = FAISS.from_documents(documents=all_splits, embedding=embeddings)
-retriever = vectorstore.as_retriever(search_type="similarity",
-                                     search_kwargs={"k": 6})
+@app.post("/admin/reload")
+async def admin_reload(x_admin_token: str = Header(default="")):
+    """Rebuild the knowledge index in the background and swap it in."""
+    if not os.getenv("ADMIN_TOKEN") or x_admin_token != os.getenv("ADMIN_TOKEN"):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+    asyncio.create_task(knowledge.reload())
+    return {"status": "reloading"}
 
 
 # Define tools
@@ -612,8 +652,7 @@ agent_executor = AgentExecutor(agent=agent,verbose=True)
 @app.post("/chat")
 async def handle_query(user_query: UserQuery):
     # Prepare the input for the agent
-    context_docs = retriever.get_relevant_documents(user_query.prompt)
-    context = "\n".join([doc.page_content for doc in context_docs])
+    context = await knowledge.aget_context(user_query.prompt)
 
     agent_input = {
         "input": user_query.prompt,
@@ -656,8 +695,7 @@ async def handle_query(user_query: UserQuery):
 @app.post("/chat/botconversa")
 async def send_message(user_query: RequestBodyBotConversa):
     # Prepare the input for the agent
-    context_docs = retriever.get_relevant_documents(user_query.prompt)
-    context = "\n".join([doc.page_content for doc in context_docs])
+    context = await knowledge.aget_context(user_query.prompt)
 
     agent_input = {
         "input": user_query.prompt,
@@ -0,0 +1,270 @@
+"""Helpers for the course catalog served by /api/v1/cursos.
+
+The API (and courses_array_example.json / cursos3.txt) return
+`{"classes": [{..., "course": {"name", "slug", ...}, "schedule", "price"}]}`.
+For the knowledge index each class becomes one compact document holding only
+what customers ask about: name, level, price, schedule and requirements.
+Image URLs, marketing copy and empty topics stay out of the index.
+
+CourseIndex answers the agent's course searches from the same payload,
+returning only the requested fields of the matching classes as short lines.
+"""
+import os
+import re
+from collections import Counter
+from datetime import datetime, timezone
+
+import requests
+from langchain_core.documents import Document
+
+from hybrid_retriever import tokenize
+from text_utils import fold_accents, words
+
+COURSES_API_URL = os.getenv("COURSES_API_URL",
+                            "https://backend-produc.herokuapp.com/api/v1/cursos")
+CATALOG_TIMEOUT = float(os.getenv("CATALOG_TIMEOUT", "10"))
+
+# Words in almost every course name that say nothing about which course it is
+GENERIC_NAME_WORDS = frozenset(["curso", "formacao", "aplicacao", "nova", "introducao"])
+# Accent-folded words of questions about the courses on offer, their prices,
+# dates, places or enrolment
+CATALOG_INTENT_WORDS = frozenset("""
+curso cursos formacao formacoes turma turmas catalogo oferta disponivel disponiveis
+preco precos valor custa custam custo pagar pagamento propina desconto
+quando data datas inicio comeca termina horario horarios duracao dura
+onde local localizacao presencial online nivel requisito requisitos
+inscricao inscrever inscrevo matricula vaga vagas certificado
+""".split())
+# Accent-folded words of questions about the whole offer ("que cursos têm?")
+CATALOG_LISTING_WORDS = frozenset("""
+cursos formacoes turmas catalogo oferta disponiveis outros outras todos todas lista quais
+""".split())
+
+
+def catalog_classes(payload):
+    """Return the list of classes from an API payload (dict or bare list)."""
+    if isinstance(payload, dict):
+        return payload.get("classes", [])
+    if isinstance(payload, list):
+        return payload
+    return []
+
+
+def _format_date(milliseconds):
+    try:
+        return datetime.fromtimestamp(int(milliseconds) / 1000, tz=timezone.utc).strftime("%d/%m/%Y")
+    except (TypeError, ValueError):
+        return None
+
+
+# Fields of a class that can be rendered, with the label each is shown under
+COURSE_FIELDS = {
+    "name": None,
+    "level": "Nível",
+    "price": "Preço",
+    "location": "Localização",
+    "address": "Morada",
+    "duration": "Duração",
+    "dates": "Datas",
+    "schedule": "Horário",
+    "requirements": "Requisitos",
+    "audience": "Público",
+    "topics": "Módulos",
+    "description": "Descrição",
+    "image": "Imagem",
+}
+DEFAULT_COURSE_FIELDS = ("name", "level", "price", "location", "dates", "schedule")
+# What each class document in the knowledge index holds
+INDEX_COURSE_FIELDS = ("name", "level", "location", "price", "duration", "dates", "schedule", "requirements")
+
+
+def _clean_list(items):
+    return list(dict.fromkeys(item.strip() for item in items or [] if item and item.strip()))
+
+
+def _price_value(price):
+    digits = re.sub(r"[^\d.]", "", str(price.get("value") or ""))
+    try:
+        return float(digits)
+    except ValueError:
+        return None
+
+
+def course_fields(cls):
+    """Every COURSE_FIELDS value of one catalog class as text, empty ones left out."""
+    course = cls.get("course", {})
+    schedule = cls.get("schedule") or {}
+    price = cls.get("price") or {}
+    address = (cls.get("geographicLocation") or {}).get("address")
+    # Dates come as epoch milliseconds from the API and as text in the exports
+    begin = _format_date(schedule.get("beginDate")) or schedule.get("beginDate")
+    end = _format_date(schedule.get("endDate")) or schedule.get("endDate")
+    hours = f", {schedule['startTime']}-{schedule.get('endTime', '')}" if schedule.get("startTime") else ""
+    fields = {
+        "name": course.get("name", "").strip(),
+        "level": cls.get("level") or course.get("level"),
+        "price": f"{price['value']} {price.get('currencyShortForm', '')}".rstrip() if price.get("value") else None,
+        "location": cls.get("location"),
+        "address": address,
+        "duration": schedule.get("duration"),
+        "dates": f"{begin} a {end}" if begin and end else begin,
+        "schedule": f"{schedule['daysOfTheWeek']}{hours}" if schedule.get("daysOfTheWeek") else None,
+        "requirements": "; ".join(_clean_list(cls.get("requirements") or course.get("requirements"))),
+        "audience": "; ".join(_clean_list(cls.get("targetAudience") or course.get("targetAudience"))),
+        "topics": "; ".join(_clean_list(topic.get("name") for topic in cls.get("topics") or [])),
+        "description": (course.get("description") or "").strip(),
+        "image": cls.get("imageURL") or course.get("imageURL"),
+    }
+    return {key: value for key, value in fields.items() if value}
+
+
+def format_fields(values, fields):
+    """Render the given fields of course_fields output as labelled parts."""
+    return [values[field] if COURSE_FIELDS[field] is None else f"{COURSE_FIELDS[field]}: {values[field]}"
+            for field in fields if field in values]
+
+
+def course_text(cls, fields=INDEX_COURSE_FIELDS):
+    """Render one catalog class as the short text block the index stores."""
+    return "\n".join(format_fields(course_fields(cls), fields))
+
+
+def course_document(cls, source=""):
+    """Return one catalog class as a Document tagged with its course_slug."""
+    course = cls.get("course", {})
+    return Document(
+        page_content=course_text(cls),
+        metadata={
+            "source": source,
+            "doc_type": "course",
+            # Kept as the catalog spells it: stripping would merge MySQL's
+            # "digitalao-bi " into Power BI's "digitalao-bi"
+            "course_slug": course.get("slug") if (course.get("slug") or "").strip() else None,
+            "course_name": course.get("name", "").strip(),
+        },
+    )
+
+
+def course_documents(payload, source=""):
+    """Return one document per public class in a catalog payload."""
+    return [course_document(cls, source) for cls in catalog_classes(payload)
+            if cls.get("public", True)]
+
+
+def load_catalog_documents(url=COURSES_API_URL, timeout=CATALOG_TIMEOUT):
+    """Fetch the courses API and parse it into per-class documents."""
+    response = requests.get(url, timeout=timeout)
+    response.raise_for_status()
+    return course_documents(response.json(), source=url)
+
+
+class CourseIndex:
+    """In-memory search over the public classes of a catalog payload."""
+
+    def __init__(self, payload):
+        self.courses = []
+        for cls in catalog_classes(payload):
+            if not cls.get("public", True):
+                continue
+            fields = course_fields(cls)
+            slug = (cls.get("course", {}).get("slug") or "").lower()
+            tokens = set(tokenize(fields.get("name", ""))) - GENERIC_NAME_WORDS
+            self.courses.append((fields, slug, tokens, _price_value(cls.get("price") or {})))
+
+    def search(self, name=None, level=None, max_price=None):
+        """Return the fields of the classes matching every filter given.
+
+        name matches a slug or words of the course name; when no course has
+        all the words, the courses sharing most of them are returned.
+        """
+        matches = self.courses
+        if level:
+            wanted = fold_accents(level)
+            matches = [course for course in matches
+                       if fold_accents(course[0].get("level", "")).startswith(wanted)]
+        if max_price:
+            matches = [course for course in matches if course[3] is not None and course[3] <= max_price]
+        if name:
+            query = set(tokenize(name)) - GENERIC_NAME_WORDS
+            overlap = [(len(query & course[2]) if course[1] != name.strip().lower() else len(query) + 1,
+                        course) for course in matches]
+            best = max((score for score, _ in overlap), default=0)
+            matches = [course for score, course in overlap if best and score == best]
+        return [course[0] for course in matches]
+
+    def format(self, results, fields=DEFAULT_COURSE_FIELDS):
+        """Render search results as one " | "-separated line per class."""
+        fields = [field for field in fields if field in COURSE_FIELDS] or DEFAULT_COURSE_FIELDS
+        lines = []
+        for result in results:
+            lines.append(" | ".join(format_fields(result, fields)))
+        return "\n".join(lines)
+
+
+_course_index = {"payload": None, "index": None}
+
+
+def course_index(payload):
+    """The CourseIndex of payload, rebuilt only when a new payload is cached."""
+    if _course_index["payload"] is not payload:
+        _course_index["index"] = CourseIndex(payload)
+        _course_index["payload"] = payload
+    return _course_index["index"]
+
+
+def catalog_text(payload, course_slug=None):
+    """Render the public classes of a catalog payload as compact text blocks.
+
+    Image URLs are included so replies built from this text alone can still
+    send the course pictures. With course_slug only that course's classes
+    are rendered.
+    """
+    return "\n\n".join(course_text(cls, INDEX_COURSE_FIELDS + ("image",))
+                       for cls in catalog_classes(payload)
+                       if cls.get("public", True)
+                       and (course_slug is None or cls.get("course", {}).get("slug") == course_slug))
+
+
+def asks_for_catalog(text):
+    """True when a question is about the courses on offer rather than one course."""
+    return any(word in CATALOG_LISTING_WORDS for word in words(text))
+
+
+def needs_catalog(text, course_slug=None):
+    """True when a question is about the courses, or about the one being discussed."""
+    return bool(course_slug) or any(word in CATALOG_INTENT_WORDS for word in words(text))
+
+
+def detect_course_slug(text, payload):
+    """Return the slug of the course text refers to, or None.
+
+    A course matches through its slug or through words of its name that no
+    other course in the catalog uses ("mysql", "power", "windows"...); the
+    course with most such words in text wins.
+    """
+    lowered = text.lower()
+    # A course can have several classes: their name words are pooled per slug
+    # so words are only counted once per course
+    name_tokens = {}
+    for cls in catalog_classes(payload):
+        course = cls.get("course", {})
+        slug = course.get("slug") or ""
+        if slug.strip():
+            tokens = set(tokenize(course.get("name", ""))) - GENERIC_NAME_WORDS
+            name_tokens.setdefault(slug, set()).update(tokens)
+    usage = Counter(token for tokens in name_tokens.values() for token in tokens)
+    # Slugs are returned as the catalog spells them, stray whitespace included;
+    # one that only differs from another by whitespace is never matched as text
+    spellings = Counter(slug.strip().lower() for slug in name_tokens)
+    text_tokens = set(tokenize(text))
+
+    best_slug, best_matches = None, 0
+    for slug, tokens in name_tokens.items():
+        key = slug.strip().lower()
+        # Whole slugs only: "digitalao-rh" must not match "digitalao-rh-2"
+        if spellings[key] == 1 and re.search(rf"(?<![\w-]){re.escape(key)}(?![\w-])", lowered):
+            return slug
+        matches = sum(1 for token in tokens & text_tokens if usage[token] == 1)
+        if matches > best_matches:
+            best_slug, best_matches = slug, matches
+    return best_slug
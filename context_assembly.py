@@ -0,0 +1,111 @@
+"""Turn retrieved chunks into the prompt context with as few tokens as possible.
+
+Chunks produced with chunk_overlap repeat the same text at their borders and
+the FAQ repeats near-identical passages across sources. assemble_context
+merges chunks that overlap in the same source (using the splitter's
+start_index metadata), drops near-duplicate passages, keeps the best-ranked
+passages that fit in the token budget and reports how many tokens that saved
+compared to joining the raw chunks.
+"""
+import os
+
+from text_utils import words
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+# Share of a passage's word shingles found in a kept passage to call it a duplicate
+DUPLICATE_THRESHOLD = 0.8
+SHINGLE_SIZE = 5
+
+
+def estimate_tokens(text):
+    """Approximate the token count (~4 characters per token) without a tokenizer."""
+    return (len(text) + 3) // 4
+
+
+def _shingles(text):
+    tokens = words(text)
+    if len(tokens) < SHINGLE_SIZE:
+        return {tuple(tokens)} if tokens else set()
+    return {tuple(tokens[i:i + SHINGLE_SIZE]) for i in range(len(tokens) - SHINGLE_SIZE + 1)}
+
+
+def _merge_overlapping(docs):
+    """Merge chunks of the same source whose character ranges touch or overlap.
+
+    Returns passages as [rank, text] where rank is the best retrieval rank of
+    the chunks merged into it.
+    """
+    passages = []
+    spans = {}
+    for rank, doc in enumerate(docs):
+        start = doc.metadata.get("start_index")
+        if start is None:
+            passages.append([rank, doc.page_content])
+            continue
+        source = doc.metadata.get("source", "")
+        spans.setdefault(source, []).append((start, start + len(doc.page_content), rank, doc.page_content))
+
+    for source_spans in spans.values():
+        source_spans.sort()
+        _, cur_end, cur_rank, cur_text = source_spans[0]
+        for start, end, rank, text in source_spans[1:]:
+            if start <= cur_end:
+                if end > cur_end:
+                    cur_text += text[cur_end - start:]
+                    cur_end = end
+                cur_rank = min(cur_rank, rank)
+            else:
+                passages.append([cur_rank, cur_text])
+                cur_end, cur_rank, cur_text = end, rank, text
+        passages.append([cur_rank, cur_text])
+
+    passages.sort(key=lambda passage: passage[0])
+    return passages
+
+
+def assemble_context(docs, token_budget=CONTEXT_TOKEN_BUDGET):
+    """Return (context, stats) for the retrieved docs in rank order."""
+    naive_tokens = estimate_tokens("\n".join(doc.page_content for doc in docs))
+
+    kept = []
+    kept_shingles = []
+    used_tokens = 0
+    duplicates = 0
+    for _, text in _merge_overlapping(docs):
+        shingles = _shingles(text)
+        # Containment is measured against this passage only: a short kept
+        # snippet must not drop a longer passage that adds to it
+        if shingles and any(len(shingles & other) >= DUPLICATE_THRESHOLD * len(shingles)
+                            for other in kept_shingles):
+            duplicates += 1
+            continue
+        tokens = estimate_tokens(text)
+        # A kept passage this one contains is replaced by it, keeping its place
+        contained = next((i for i, other in enumerate(kept_shingles)
+                          if other and len(shingles & other) >= DUPLICATE_THRESHOLD * len(other)), None)
+        if contained is not None:
+            extra_tokens = tokens - estimate_tokens(kept[contained])
+            if used_tokens + extra_tokens <= token_budget:
+                kept[contained] = text
+                kept_shingles[contained] = shingles
+                used_tokens += extra_tokens
+                duplicates += 1
+                continue
+        if kept and used_tokens + tokens > token_budget:
+            # Lower-ranked passages that do not fit are left out entirely
+            continue
+        kept.append(text)
+        kept_shingles.append(shingles)
+        used_tokens += tokens
+
+    context = "\n".join(kept)
+    context_tokens = estimate_tokens(context)
+    stats = {
+        "chunks": len(docs),
+        "passages": len(kept),
+        "duplicates_dropped": duplicates,
+        "naive_tokens": naive_tokens,
+        "tokens": context_tokens,
+        "tokens_saved": max(0, naive_tokens - context_tokens),
+    }
+    return context, stats
@@ -0,0 +1,71 @@
+"""Micro-batching of concurrent query embeddings.
+
+During campaign bursts many webhooks arrive within a few milliseconds of each
+other and each one would make its own embedding request. EmbeddingBatcher
+holds queries for a short window (or until max_batch_size is reached), embeds
+the unique texts in one call and resolves every waiting request with its
+vector. Batch sizes and the time requests spent waiting for their batch are
+recorded in `metrics` under `embedding_batcher.*`.
+"""
+import asyncio
+import os
+import time
+
+import metrics
+
+EMBEDDING_BATCH_WINDOW_MS = float(os.getenv("EMBEDDING_BATCH_WINDOW_MS", "10"))
+EMBEDDING_BATCH_MAX_SIZE = int(os.getenv("EMBEDDING_BATCH_MAX_SIZE", "32"))
+
+
+class EmbeddingBatcher:
+    """Collects embed requests from the event loop into batched calls."""
+
+    def __init__(self, embed_many, window_ms=EMBEDDING_BATCH_WINDOW_MS,
+                 max_batch_size=EMBEDDING_BATCH_MAX_SIZE, executor=None):
+        self.embed_many = embed_many
+        self.window = window_ms / 1000
+        self.max_batch_size = max_batch_size
+        self.executor = executor
+        self._pending = []
+        self._timer = None
+
+    async def embed(self, text):
+        """Return the embedding of text, sharing a call with concurrent requests."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future, time.perf_counter()))
+        if len(self._pending) >= self.max_batch_size:
+            self._dispatch()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._dispatch)
+        return await future
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch):
+        dispatched_at = time.perf_counter()
+        texts = list(dict.fromkeys(text for text, _, _ in batch))
+        metrics.observe("embedding_batcher.batch_size", len(batch))
+        metrics.observe("embedding_batcher.unique_texts", len(texts))
+        metrics.observe("embedding_batcher.wait_ms",
+                        (dispatched_at - min(queued for _, _, queued in batch)) * 1000)
+        loop = asyncio.get_running_loop()
+        try:
+            vectors = await loop.run_in_executor(self.executor, self.embed_many, texts)
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        metrics.observe("embedding_batcher.call_ms", (time.perf_counter() - dispatched_at) * 1000)
+        by_text = dict(zip(texts, vectors))
+        for text, future, _ in batch:
+            # Requests that timed out meanwhile have a cancelled future
+            if not future.done():
+                future.set_result(by_text[text])
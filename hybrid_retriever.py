@@ -0,0 +1,239 @@
+"""Hybrid lexical + vector retrieval for the Buka knowledge base.
+
+Course names such as "Power BI", "MySQL" or "Windows Server 2022" are exact
+lexical matches that embedding similarity alone sometimes ranks below generic
+FAQ chunks. HybridRetriever runs an in-process BM25 search next to the vector
+search and merges both rankings with reciprocal rank fusion (RRF).
+
+The number of chunks adapts to the query: k is only an upper bound. Small
+talk ("Olá", "obrigado") has no content words and retrieves nothing, and
+vector hits below score_threshold cosine similarity are dropped.
+"""
+import math
+import threading
+from collections import Counter, defaultdict
+from functools import lru_cache
+from typing import Any, List
+
+import numpy as np
+from cachetools import LRUCache
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from text_utils import words
+
+# Accent-folded Portuguese stopwords plus greetings, so chit-chat such as
+# "Olá, bom dia" has no lexical matches at all
+PORTUGUESE_STOPWORDS = frozenset("""
+a o as os um uma uns umas de do da dos das d em no na nos nas num numa por pelo
+pela pelos pelas para pra pro com sem sob e ou mas nem que se ao aos eu tu ele
+ela nos vos eles elas voce voces me te lhe lhes mim ti si meu minha meus minhas
+teu tua seu sua seus suas nosso nossa isso isto esse essa esses essas este esta
+estes estas aquele aquela aquilo qual quais quem como quando onde porque ja nao
+sim mais menos muito muita muitos muitas tambem so ser sou e sao era foi estar
+estou esta estao ter tenho tem tinha ha haver vai vou pode posso gostaria queria
+quero fale falar diga dizer sobre entao aqui ali la ola oi bom boa dia tarde
+noite obrigado obrigada favor tudo bem ok certo perfeito otimo entendi beleza
+valeu tchau ate logo hello hi hey
+""".split())
+
+
+def tokenize(text):
+    """Accent-fold, drop stopwords and strip plural "s" from Portuguese text."""
+    tokens = []
+    for word in words(text):
+        if word in PORTUGUESE_STOPWORDS:
+            continue
+        # "cursos" and "curso" should match; applied to both sides consistently
+        if len(word) > 4 and word.endswith("s"):
+            word = word[:-1]
+        tokens.append(word)
+    return tokens
+
+
+class FilterMasks:
+    """Boolean masks of the documents each metadata filter keeps.
+
+    Calling a filter on every document is a Python loop over the corpus, so
+    each mask is computed once and cached by filter identity;
+    course_scope_filter returns the same function for the same course.
+    """
+
+    def __init__(self, documents, maxsize=256):
+        self.documents = documents
+        self._masks = LRUCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+
+    def get(self, metadata_filter):
+        with self._lock:
+            mask = self._masks.get(metadata_filter)
+        if mask is None:
+            mask = np.fromiter((bool(metadata_filter(doc.metadata)) for doc in self.documents),
+                               dtype=bool, count=len(self.documents))
+            with self._lock:
+                self._masks[metadata_filter] = mask
+        return mask
+
+    def clear(self):
+        with self._lock:
+            self._masks.clear()
+
+
+class BM25Index:
+    """Okapi BM25 over an inverted index of tokenized documents.
+
+    Each posting list is stored as NumPy arrays of document ids and their
+    precomputed term weights, so a query costs one vector addition per term.
+    """
+
+    def __init__(self, documents, k1=1.5, b=0.75):
+        self.documents = list(documents)
+        self.k1 = k1
+        self.b = b
+        self.masks = FilterMasks(self.documents)
+        postings = defaultdict(list)
+        self.doc_lengths = []
+        for doc_id, doc in enumerate(self.documents):
+            term_counts = Counter(tokenize(doc.page_content))
+            self.doc_lengths.append(sum(term_counts.values()))
+            for term, tf in term_counts.items():
+                postings[term].append((doc_id, tf))
+        n_docs = len(self.documents)
+        self.avg_length = (sum(self.doc_lengths) / n_docs) if n_docs else 0.0
+        self.idf = {
+            term: math.log(1 + (n_docs - len(term_postings) + 0.5) / (len(term_postings) + 0.5))
+            for term, term_postings in postings.items()
+        }
+        # term -> (doc ids, tf saturated and normalised by document length)
+        self.postings = {}
+        for term, term_postings in postings.items():
+            doc_ids = np.array([doc_id for doc_id, _ in term_postings], dtype=np.int64)
+            tfs = np.array([tf for _, tf in term_postings], dtype=np.float64)
+            lengths = np.array([self.doc_lengths[doc_id] for doc_id in doc_ids], dtype=np.float64)
+            length_norm = 1 - b + b * lengths / (self.avg_length or 1)
+            self.postings[term] = (doc_ids, tfs * (k1 + 1) / (tfs + k1 * length_norm))
+
+    def search(self, query, k=10, metadata_filter=None):
+        """Return up to k (doc_id, score) pairs with a positive score."""
+        terms = [term for term in set(tokenize(query)) if term in self.postings]
+        if not terms:
+            return []
+        scores = np.zeros(len(self.documents))
+        for term in terms:
+            doc_ids, weights = self.postings[term]
+            scores[doc_ids] += self.idf[term] * weights
+        if metadata_filter is not None:
+            scores[~self.masks.get(metadata_filter)] = 0
+        hits = np.flatnonzero(scores > 0)
+        if len(hits) > k:
+            hits = hits[np.argpartition(-scores[hits], k - 1)[:k]]
+        # Best score first, ties in document order
+        hits = hits[np.lexsort((hits, -scores[hits]))]
+        return [(int(doc_id), float(scores[doc_id])) for doc_id in hits]
+
+
+def is_small_talk(query):
+    """True when query has no content words, so there is nothing to retrieve."""
+    return not tokenize(query)
+
+
+def cosine_similarity(vectorstore, score):
+    """Convert a vector store score into the cosine similarity of unit vectors."""
+    strategy = getattr(vectorstore, "distance_strategy", None)
+    if getattr(strategy, "value", strategy) == "EUCLIDEAN_DISTANCE":
+        # FAISS L2 indexes return squared distances: |a - b|^2 = 2 - 2 cos
+        return 1 - score / 2
+    return score
+
+
+def reciprocal_rank_fusion(rankings, rrf_k=60):
+    """Merge several ranked lists of keys; earlier ranks weigh more."""
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, key in enumerate(ranking):
+            scores[key] += 1.0 / (rrf_k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+@lru_cache(maxsize=1024)
+def course_scope_filter(course_slug):
+    """Metadata filter keeping general chunks plus the chunks of one course.
+
+    Course chunks without a slug (plain-text course blocks) belong to some
+    other course, so only non-course chunks count as general.
+    """
+    def keep(metadata):
+        return metadata.get("doc_type") != "course" or metadata.get("course_slug") == course_slug
+    return keep
+
+
+def vectorstore_documents(vectorstore):
+    """Return the chunks held by a vector store in index order."""
+    if hasattr(vectorstore, "documents"):
+        return list(vectorstore.documents)
+    # FAISS keeps them in its docstore
+    return [
+        vectorstore.docstore.search(vectorstore.index_to_docstore_id[i])
+        for i in range(len(vectorstore.index_to_docstore_id))
+    ]
+
+
+class HybridRetriever(BaseRetriever):
+    """BM25 + vector retriever fused by reciprocal rank."""
+
+    vectorstore: Any
+    bm25: Any
+    k: int = 4
+    fetch_k: int = 10
+    rrf_k: int = 60
+    # Lexical hits scoring below this fraction of the best hit are dropped, so
+    # incidental matches on common words like "curso" do not dilute the fusion
+    lexical_cutoff: float = 0.5
+    # Vector hits below this cosine similarity are dropped
+    score_threshold: float = 0.0
+
+    @classmethod
+    def from_vectorstore(cls, vectorstore, **kwargs):
+        bm25 = BM25Index(vectorstore_documents(vectorstore))
+        return cls(vectorstore=vectorstore, bm25=bm25, **kwargs)
+
+    def _get_relevant_documents(self, query, *, run_manager=None) -> List[Document]:
+        return self.search(query)
+
+    def search(self, query, embedding=None, metadata_filter=None):
+        """Retrieve for query, optionally with a precomputed query embedding.
+
+        metadata_filter is a callable taking a chunk's metadata; only chunks
+        for which it returns True are considered by either search. Returns
+        between 0 and k documents.
+        """
+        if is_small_talk(query):
+            return []
+        search_kwargs = {"k": self.fetch_k}
+        if metadata_filter is not None:
+            # FAISS filters after searching, so look further to still fill fetch_k
+            search_kwargs.update(filter=metadata_filter, fetch_k=self.fetch_k * 5)
+        if embedding is None:
+            scored = self.vectorstore.similarity_search_with_score(query, **search_kwargs)
+        else:
+            scored = self.vectorstore.similarity_search_with_score_by_vector(embedding, **search_kwargs)
+        vector_docs = [doc for doc, score in scored
+                       if cosine_similarity(self.vectorstore, score) >= self.score_threshold]
+        return self._fuse(query, vector_docs, metadata_filter)
+
+    def _fuse(self, query, vector_docs, metadata_filter=None):
+        lexical_hits = self.bm25.search(query, self.fetch_k, metadata_filter)
+        min_score = lexical_hits[0][1] * self.lexical_cutoff if lexical_hits else 0.0
+        lexical_docs = [self.bm25.documents[doc_id]
+                        for doc_id, score in lexical_hits if score >= min_score]
+
+        # Chunks are identified by their text since both lists come from the same
+        # store; lexical hits go first so exact course-name matches win ties
+        by_content = {}
+        for doc in lexical_docs + vector_docs:
+            by_content.setdefault(doc.page_content, doc)
+        fused = reciprocal_rank_fusion(
+            [[doc.page_content for doc in lexical_docs],
+             [doc.page_content for doc in vector_docs]],
+            rrf_k=self.rrf_k)
+        return [by_content[content] for content in fused[:self.k]]
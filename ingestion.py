@@ -0,0 +1,240 @@
+"""Structure-aware ingestion of the Buka knowledge files.
+
+rag.txt is a strict "Pergunta: / Resposta:" FAQ and cursos3.txt starts with
+the course catalog JSON followed by the same FAQ. Cutting them into fixed
+1000-character windows splits answers in half and repeats neighbours in the
+200-character overlap, so instead every Q&A pair and every course becomes one
+document, which the index keeps as a single chunk (see
+`knowledge_index.split_documents` with splitter="structured").
+
+The same FAQ and courses are repeated across rag.txt, cursos.txt,
+cursos3.txt, courses_array_example.json and the live courses API.
+`load_knowledge_documents` loads all KNOWLEDGE_SOURCES concurrently and keeps
+each question and course from the first source that has it, and `create_knowledge_base` gives
+every app the same settings, so they all share one index under
+KNOWLEDGE_INDEX_DIR. Build it ahead of a deploy with:
+
+    python ingestion.py build
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.documents import Document
+
+from catalog import COURSES_API_URL, course_documents, load_catalog_documents
+from knowledge_index import KnowledgeBase
+from text_utils import words
+
+logger = logging.getLogger(__name__)
+
+# Comma-separated files or URLs; on duplicates the earlier source wins, so the
+# maintained FAQ (rag.txt) and the live catalog come before the old exports
+KNOWLEDGE_SOURCES = [source.strip() for source in os.getenv(
+    "KNOWLEDGE_SOURCES",
+    f"./rag.txt,{COURSES_API_URL},./cursos3.txt,./courses_array_example.json,./cursos.txt",
+).split(",") if source.strip()]
+
+# Seconds between re-reads of URL sources, in line with the apps' course cache
+CATALOG_REFRESH_INTERVAL = int(os.getenv("CATALOG_REFRESH_INTERVAL", "600"))
+
+QUESTION_PREFIX = "Pergunta:"
+ANSWER_PREFIX = "Resposta:"
+# Plain-text course blocks in cursos.txt: a title line followed by "Descrição:"
+COURSE_BLOCK = re.compile(r"^(?P<name>[^\n:]+)\n(?=Descrição:)", re.MULTILINE)
+
+
+def _faq_document(question, answer_lines, source):
+    # A trailing "Observações:" style line introduces the next section, not
+    # anything in this answer
+    while answer_lines and answer_lines[-1].endswith(":"):
+        answer_lines = answer_lines[:-1]
+    answer = "\n".join(answer_lines).strip()
+    return Document(
+        page_content=f"{QUESTION_PREFIX} {question}\n{ANSWER_PREFIX} {answer}",
+        metadata={"source": source, "doc_type": "faq", "question": question},
+    )
+
+
+def split_faq(text, source=""):
+    """Return one document per "Pergunta:/Resposta:" pair in text.
+
+    An answer ends at the first blank line. Each question is also repeated
+    as a heading line right before its "Pergunta:" line; that heading would
+    otherwise end up at the bottom of the previous answer, so it is dropped.
+    """
+    docs = []
+    question, answer_lines, answer_done = None, [], False
+    for line in text.splitlines():
+        stripped = line.strip()
+        if stripped.startswith(QUESTION_PREFIX):
+            next_question = stripped[len(QUESTION_PREFIX):].strip()
+            if question is not None:
+                if answer_lines and answer_lines[-1] == next_question:
+                    answer_lines.pop()
+                docs.append(_faq_document(question, answer_lines, source))
+            question, answer_lines, answer_done = next_question, [], False
+        elif question is not None and not answer_done:
+            if stripped.startswith(ANSWER_PREFIX):
+                stripped = stripped[len(ANSWER_PREFIX):].strip()
+            if stripped:
+                answer_lines.append(stripped)
+            elif answer_lines:
+                answer_done = True
+    if question is not None:
+        docs.append(_faq_document(question, answer_lines, source))
+    return docs
+
+
+def split_course_blocks(text, source=""):
+    """Return one document per plain-text course block ("NAME\\nDescrição: ...")."""
+    docs = []
+    for match in COURSE_BLOCK.finditer(text):
+        block = text[match.start():].split("\n\n", 1)[0].strip()
+        docs.append(Document(
+            page_content=block,
+            metadata={"source": source, "doc_type": "course",
+                      "course_name": match.group("name").strip()},
+        ))
+    return docs
+
+
+def split_knowledge_text(text, source=""):
+    """Split one knowledge file into course and FAQ documents.
+
+    A leading JSON catalog (cursos3.txt) yields one document per class; the
+    text after it, or the whole file otherwise, is read as course blocks and
+    Q&A pairs. Anything else (titles, section headings) is left out.
+    """
+    docs = []
+    stripped = text.lstrip()
+    if stripped.startswith(("{", "[")):
+        try:
+            payload, end = json.JSONDecoder().raw_decode(stripped)
+        except json.JSONDecodeError as e:
+            logger.warning(f"{source} starts like JSON but does not parse: {e}")
+        else:
+            docs.extend(course_documents(payload, source))
+            stripped = stripped[end:]
+    faq_start = stripped.find(QUESTION_PREFIX)
+    courses_text = stripped if faq_start < 0 else stripped[:faq_start]
+    docs.extend(split_course_blocks(courses_text, source))
+    docs.extend(split_faq(stripped, source))
+    return docs
+
+
+def is_url(source):
+    return source.startswith(("http://", "https://"))
+
+
+def load_source(source):
+    """Load one file or courses API URL as structured documents."""
+    if is_url(source):
+        docs = load_catalog_documents(source)
+    else:
+        with open(source, encoding="UTF-8") as f:
+            docs = split_knowledge_text(f.read(), source=source)
+    logger.info(f"Ingested {source}: {len(docs)} documents")
+    return docs
+
+
+def _identity(doc):
+    """Key under which two documents count as the same knowledge."""
+    doc_type = doc.metadata.get("doc_type")
+    # Sources word the same course or question slightly differently
+    if doc_type == "course" and doc.metadata.get("course_name"):
+        return ("course", " ".join(words(doc.metadata["course_name"])))
+    if doc_type == "faq" and doc.metadata.get("question"):
+        return ("faq", " ".join(words(doc.metadata["question"])))
+    return None
+
+
+def deduplicate(docs):
+    """Keep the first document per content hash, and each course and question
+    from the first source that has it.
+
+    A catalog lists one document per class, so a source can hold several
+    documents for one course (other dates, another location); all of those
+    are kept. Only copies of it in later sources are dropped.
+    """
+    seen_hashes = set()
+    # Identity -> source that claimed it
+    owners = {}
+    unique = []
+    for doc in docs:
+        content_hash = hashlib.sha256(" ".join(doc.page_content.split()).encode("utf-8")).hexdigest()
+        identity = _identity(doc)
+        source = doc.metadata.get("source")
+        if content_hash in seen_hashes or owners.get(identity, source) != source:
+            continue
+        seen_hashes.add(content_hash)
+        if identity is not None:
+            owners.setdefault(identity, source)
+        unique.append(doc)
+    return unique
+
+
+def load_knowledge_documents(sources=None):
+    """Load every source concurrently and return the deduplicated documents.
+
+    A source that fails (the courses API being down, a missing export) is
+    skipped with a warning; only when all of them fail is the error raised.
+    """
+    sources = sources or KNOWLEDGE_SOURCES
+    with ThreadPoolExecutor(max_workers=len(sources), thread_name_prefix="ingestion") as executor:
+        futures = [executor.submit(load_source, source) for source in sources]
+    docs, errors = [], []
+    for source, future in zip(sources, futures):
+        try:
+            docs.extend(future.result())
+        except Exception as e:
+            logger.warning(f"Skipping knowledge source {source}: {e}")
+            errors.append(e)
+    if errors and len(errors) == len(sources):
+        raise errors[0]
+    unique = deduplicate(docs)
+    logger.info(f"Ingested {len(unique)} documents from {len(sources) - len(errors)} sources "
+                f"({len(docs) - len(unique)} duplicates dropped)")
+    return unique
+
+
+def create_knowledge_base(embeddings, embedding_model, sources=None, **kwargs):
+    """Return a KnowledgeBase over the unified sources with the shared settings.
+
+    Every app builds through here so they all compute the same index key and
+    load the same persisted index. File sources are watched for changes and
+    URL sources re-read every CATALOG_REFRESH_INTERVAL seconds (by
+    `KnowledgeBase.watch_sources`).
+    """
+    sources = sources or KNOWLEDGE_SOURCES
+    return KnowledgeBase(lambda: load_knowledge_documents(sources),
+                         embeddings, embedding_model,
+                         chunk_size=1000, chunk_overlap=200,
+                         watch_paths=[source for source in sources if not is_url(source)],
+                         # The courses API cannot be watched, so it is polled
+                         refresh_interval=CATALOG_REFRESH_INTERVAL if any(map(is_url, sources)) else 0,
+                         splitter="structured", **kwargs)
+
+
+def _build_command(args):
+    from knowledge_index import get_embeddings
+
+    embeddings, embedding_model = get_embeddings()
+    knowledge = create_knowledge_base(embeddings, embedding_model, sources=args.sources)
+    knowledge.build()
+    print(json.dumps({"version": knowledge.version, "sources": args.sources or KNOWLEDGE_SOURCES}))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Knowledge ingestion tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser("build", help="ingest every source and build the shared index")
+    build.add_argument("--sources", nargs="+", default=None)
+    build.set_defaults(func=_build_command)
+    args = parser.parse_args()
+    args.func(args)
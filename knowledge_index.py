@@ -0,0 +1,484 @@
+"""Persisted vector index for the Buka knowledge base.
+
+Each index is saved under KNOWLEDGE_INDEX_DIR in a folder named after a hash of
+the source documents, the splitter and store settings and the embedding model.
+When none of those changed the index is loaded from disk instead of
+re-embedding everything; when any of them changed a new folder is built next
+to the old one.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain.embeddings import CacheBackedEmbeddings
+from langchain.storage import LocalFileStore
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from dotenv import load_dotenv
+
+from hybrid_retriever import HybridRetriever, course_scope_filter, is_small_talk
+from retrieval_cache import CachedQueryEmbeddings, RetrievalCache
+from embedding_batcher import EMBEDDING_BATCH_WINDOW_MS, EmbeddingBatcher
+from context_assembly import assemble_context
+from vector_stores import build_vectorstore, load_vectorstore
+from ann_index import INDEX_TYPE
+import metrics
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Bump when the on-disk layout changes so old artifacts are ignored
+INDEX_FORMAT_VERSION = 1
+INDEX_DIR = os.getenv("KNOWLEDGE_INDEX_DIR", "./.knowledge_index")
+EMBEDDING_MODEL = "models/embedding-001"
+# "google" (GoogleGenerativeAIEmbeddings) or "local" (offline HashingEmbeddings)
+EMBEDDINGS_BACKEND = os.getenv("EMBEDDINGS_BACKEND", "google")
+# One of vector_stores.VECTOR_BACKENDS: "faiss" (float32 in every process),
+# "chroma", "numpy" or "float16" / "int8" (memory-mapped and shared by all
+# workers through the page cache); compare them with
+# `python vector_stores.py benchmark`
+VECTOR_STORE = os.getenv("VECTOR_STORE", "faiss")
+# Splitters: "recursive" cuts sources into overlapping chunk_size windows;
+# "structured" keeps each pre-split document (Q&A pair, course, see
+# ingestion.py) whole
+MANIFEST_FILE = "manifest.json"
+# Index folders kept after a build, newest first; older ones are deleted. More
+# than one so workers still on the previous index during a rollout keep it
+INDEX_KEEP = int(os.getenv("KNOWLEDGE_INDEX_KEEP", "2"))
+# Retrieval runs in its own bounded pool so slow embedding calls cannot stall
+# the event loop or starve the default executor used by the agent runs
+RETRIEVAL_WORKERS = int(os.getenv("RETRIEVAL_WORKERS", "4"))
+RETRIEVAL_TIMEOUT = float(os.getenv("RETRIEVAL_TIMEOUT", "3"))
+# Minimum cosine similarity for a vector hit; k is only the upper bound. Set
+# to override the default of the embedding model (see score_threshold)
+RETRIEVAL_SCORE_THRESHOLD = os.getenv("RETRIEVAL_SCORE_THRESHOLD")
+# Default thresholds by embedding model name prefix. The local hashing
+# embeddings score unrelated chunks around 0.1; Google's embedding-001 puts
+# everything higher, with unrelated Portuguese text reaching about 0.55
+SCORE_THRESHOLDS = {
+    "local-hashing": 0.2,
+    "models/embedding-001": 0.6,
+}
+# Chunk vectors keyed by content hash, shared by every index build
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR",
+                                os.path.join(INDEX_DIR, "embeddings"))
+# Context injected while the index is still building (no retrieval available)
+CATALOG_ONLY_CONTEXT = (
+    "A base de conhecimento da Buka ainda está a ser carregada. Responda apenas "
+    "com a informação dos cursos disponíveis e, para outras dúvidas, indique o "
+    "contacto geral@bukaapp.net."
+)
+
+
+def cached_embeddings(embeddings, embedding_model=EMBEDDING_MODEL,
+                      cache_dir=EMBEDDING_CACHE_DIR):
+    """Wrap embeddings so chunk vectors are persisted and reused across builds.
+
+    Vectors are keyed by a hash of the chunk text namespaced by the model, so a
+    rebuild after editing one FAQ answer only embeds the chunks that changed.
+    Query embeddings pass straight through to the wrapped model.
+    """
+    store = LocalFileStore(cache_dir)
+    return CacheBackedEmbeddings.from_bytes_store(embeddings, store,
+                                                  namespace=embedding_model)
+
+
+def get_embeddings(backend=EMBEDDINGS_BACKEND):
+    """Return (embeddings, model_name) for the configured embedding backend.
+
+    The Google backend falls back to the local one when no API key is set, so
+    the apps can still boot in CI and air-gapped environments.
+    """
+    if backend == "google" and not os.getenv("GOOGLE_API_KEY"):
+        logger.warning("GOOGLE_API_KEY is not set, using local embeddings")
+        backend = "local"
+    if backend == "local":
+        from local_embeddings import HashingEmbeddings
+        local_embeddings = HashingEmbeddings()
+        return CachedQueryEmbeddings(local_embeddings), local_embeddings.model_name
+    if backend == "google":
+        from langchain_google_genai import GoogleGenerativeAIEmbeddings
+        google_embeddings = cached_embeddings(GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL))
+        return CachedQueryEmbeddings(google_embeddings), EMBEDDING_MODEL
+    raise ValueError(f"Unknown embeddings backend: {backend}")
+
+
+def score_threshold(embedding_model):
+    """Minimum cosine similarity for vector hits with embedding_model; 0 for unknown models."""
+    if RETRIEVAL_SCORE_THRESHOLD:
+        return float(RETRIEVAL_SCORE_THRESHOLD)
+    for prefix, threshold in SCORE_THRESHOLDS.items():
+        if embedding_model.startswith(prefix):
+            return threshold
+    return 0.0
+
+
+def index_key(docs, embedding_model, splitter_settings):
+    """Hash everything that affects the index contents."""
+    digest = hashlib.sha256()
+    digest.update(str(INDEX_FORMAT_VERSION).encode())
+    digest.update(embedding_model.encode())
+    digest.update(json.dumps(splitter_settings, sort_keys=True).encode())
+    for doc in docs:
+        # Metadata is part of the key since retrieval filters on it
+        digest.update(json.dumps(doc.metadata, sort_keys=True, default=str).encode())
+        digest.update(b"\0")
+        digest.update(doc.page_content.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()[:16]
+
+
+def _save_index(write, path, manifest):
+    """Write the index with write(folder) to a temp folder and move it into place in one step."""
+    parent = os.path.dirname(path)
+    os.makedirs(parent, exist_ok=True)
+    tmp_path = tempfile.mkdtemp(dir=parent, prefix=".tmp-")
+    try:
+        write(tmp_path)
+        with open(os.path.join(tmp_path, MANIFEST_FILE), "w", encoding="UTF-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+    except Exception:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+    try:
+        os.replace(tmp_path, path)
+    except OSError:
+        # Another worker finished the same build first; keep theirs
+        logger.info(f"Index {path} already written by another process")
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+def _discard_index(path):
+    """Move an unreadable index out of path, then delete it.
+
+    os.replace cannot move a new build onto a non-empty folder, so a broken
+    index left in place would block every rebuild. The rename is atomic, so
+    other workers never see a half-deleted folder under the index key.
+    """
+    broken_path = f"{path}.broken-{os.getpid()}-{int(time.time())}"
+    try:
+        os.replace(path, broken_path)
+    except OSError as e:
+        logger.warning(f"Could not move broken index {path} aside: {e}")
+        return
+    shutil.rmtree(broken_path, ignore_errors=True)
+
+
+def prune_indexes(index_dir=INDEX_DIR, keep=INDEX_KEEP, current=None):
+    """Delete all but the keep most recently built index folders in index_dir.
+
+    Only folders holding a manifest count as indexes, so the embedding cache
+    and in-progress builds are left alone; current is never deleted.
+    """
+    try:
+        names = os.listdir(index_dir)
+    except OSError:
+        return []
+    manifests = [(os.path.getmtime(os.path.join(index_dir, name, MANIFEST_FILE)), name)
+                 for name in names if os.path.isfile(os.path.join(index_dir, name, MANIFEST_FILE))]
+    pruned = []
+    for _, name in sorted(manifests, reverse=True)[keep:]:
+        if name == current:
+            continue
+        shutil.rmtree(os.path.join(index_dir, name), ignore_errors=True)
+        pruned.append(name)
+    if pruned:
+        logger.info(f"Pruned superseded knowledge indexes: {', '.join(pruned)}")
+    return pruned
+
+
+def index_settings(chunk_size, chunk_overlap, vector_store=VECTOR_STORE,
+                   index_type=INDEX_TYPE, splitter="recursive"):
+    """Describe the splitter and store configuration that goes into the index key."""
+    settings = {
+        "splitter": "RecursiveCharacterTextSplitter" if splitter == "recursive" else splitter,
+        "chunk_size": chunk_size,
+        "chunk_overlap": chunk_overlap,
+        "add_start_index": True,
+        "vector_store": vector_store,
+    }
+    if vector_store == "faiss":
+        settings["index_type"] = index_type
+    return settings
+
+
+def split_documents(docs, chunk_size=1000, chunk_overlap=200, splitter="recursive"):
+    """Cut docs into index chunks according to splitter.
+
+    With "structured" each document is already one chunk; only the rare
+    document longer than chunk_size is cut further so it still embeds well.
+    """
+    # start_index lets context assembly merge overlapping neighbour chunks
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size,
+                                                   chunk_overlap=chunk_overlap,
+                                                   add_start_index=True)
+    if splitter == "recursive":
+        return text_splitter.split_documents(docs)
+    if splitter == "structured":
+        splits = []
+        for doc in docs:
+            if len(doc.page_content) > chunk_size:
+                splits.extend(text_splitter.split_documents([doc]))
+            else:
+                splits.append(doc)
+        return splits
+    raise ValueError(f"Unknown splitter: {splitter}")
+
+
+def load_or_build_index(docs, embeddings, embedding_model=EMBEDDING_MODEL,
+                        chunk_size=1000, chunk_overlap=200,
+                        index_dir=INDEX_DIR, vector_store=VECTOR_STORE,
+                        splitter="recursive"):
+    """Return a vector store for docs, reusing the persisted one when possible."""
+    settings = index_settings(chunk_size, chunk_overlap, vector_store, splitter=splitter)
+    key = index_key(docs, embedding_model, settings)
+    path = os.path.join(index_dir, key)
+
+    if os.path.exists(os.path.join(path, MANIFEST_FILE)):
+        start = time.perf_counter()
+        try:
+            vectorstore = load_vectorstore(vector_store, path, embeddings)
+            logger.info(
+                f"Loaded knowledge index {key} in {(time.perf_counter() - start) * 1000:.1f} ms")
+            return vectorstore
+        except Exception as e:
+            logger.warning(f"Failed to load knowledge index {key}, rebuilding: {e}")
+            _discard_index(path)
+
+    start = time.perf_counter()
+    all_splits = split_documents(docs, chunk_size, chunk_overlap, splitter)
+    built = {}
+
+    def write(folder):
+        built["vectorstore"] = build_vectorstore(vector_store, all_splits, embeddings, folder)
+
+    _save_index(write, path, {
+        "format_version": INDEX_FORMAT_VERSION,
+        "key": key,
+        "embedding_model": embedding_model,
+        "settings": settings,
+        "sources": sorted({str(doc.metadata.get("source", "")) for doc in docs}),
+        "chunks": len(all_splits),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    })
+    logger.info(
+        f"Built knowledge index {key} ({len(all_splits)} chunks) in {time.perf_counter() - start:.1f} s")
+    # Serve the copy at its final path: Chroma keeps the path it was opened
+    # with and the array stores are then memory-mapped
+    try:
+        return load_vectorstore(vector_store, path, embeddings)
+    except Exception as e:
+        if vector_store == "chroma":
+            # Its client points at the temp folder, which no longer exists
+            raise
+        logger.warning(f"Failed to reopen knowledge index {key}, serving the build in memory: {e}")
+        return built["vectorstore"]
+
+
+class KnowledgeBase:
+    """Holds the app retriever and builds it off the request path.
+
+    Until the first build finishes `retriever` is None and `get_context`
+    returns `degraded_context`, so the app can answer from the course catalog
+    while the embeddings are computed. Reloads build a complete new retriever
+    first and then replace the (retriever, version) pair in one assignment, so
+    a request always searches either the old index or the new one. Retrieved
+    documents are cached per index version.
+    """
+
+    def __init__(self, load_docs, embeddings, embedding_model=EMBEDDING_MODEL,
+                 chunk_size=1000, chunk_overlap=200, k=4,
+                 degraded_context="", watch_paths=None, splitter="recursive",
+                 refresh_interval=0):
+        self.load_docs = load_docs
+        self.embeddings = embeddings
+        self.embedding_model = embedding_model
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.splitter = splitter
+        self.k = k
+        self.degraded_context = degraded_context
+        self.watch_paths = watch_paths or []
+        # Seconds between reloads for sources that cannot be watched; 0 disables
+        self.refresh_interval = refresh_interval
+        self.error = None
+        self.cache = RetrievalCache()
+        self._active = (None, None)
+        self._reload_lock = asyncio.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS,
+                                            thread_name_prefix="retrieval")
+        # Concurrent async queries share one embedding call; 0 disables batching
+        self.batcher = None
+        if EMBEDDING_BATCH_WINDOW_MS > 0:
+            embed_many = getattr(embeddings, "embed_queries", embeddings.embed_documents)
+            self.batcher = EmbeddingBatcher(embed_many, executor=self._executor)
+
+    @property
+    def retriever(self):
+        return self._active[0]
+
+    @property
+    def version(self):
+        """Key of the index currently served, None until the first build."""
+        return self._active[1]
+
+    @property
+    def ready(self):
+        return self.retriever is not None
+
+    def build(self):
+        """Load the sources and (re)build or load the persisted index."""
+        docs = self.load_docs()
+        version = index_key(docs, self.embedding_model,
+                            index_settings(self.chunk_size, self.chunk_overlap,
+                                           splitter=self.splitter))
+        if version == self.version:
+            # Nothing changed since the index being served was built
+            self.error = None
+            return
+        vectorstore = load_or_build_index(docs, self.embeddings,
+                                          self.embedding_model,
+                                          chunk_size=self.chunk_size,
+                                          chunk_overlap=self.chunk_overlap,
+                                          splitter=self.splitter)
+        retriever = HybridRetriever.from_vectorstore(vectorstore, k=self.k,
+                                                     score_threshold=score_threshold(self.embedding_model))
+        self._active = (retriever, version)
+        # Entries for the previous version can never be hit again
+        self.cache.clear()
+        self.error = None
+        prune_indexes(current=version)
+
+    async def build_in_background(self, retry_delay=30):
+        """Build the index in a worker thread, retrying until it succeeds."""
+        while True:
+            try:
+                await asyncio.to_thread(self.build)
+                logger.info("Knowledge index is ready")
+                return
+            except Exception as e:
+                self.error = str(e)
+                logger.error(f"Failed to build knowledge index, retrying in {retry_delay}s: {e}")
+                await asyncio.sleep(retry_delay)
+
+    async def reload(self):
+        """Rebuild the index in a worker thread and swap it in when complete."""
+        if self._reload_lock.locked():
+            logger.info("Knowledge reload already in progress")
+            return False
+        async with self._reload_lock:
+            try:
+                await asyncio.to_thread(self.build)
+            except Exception as e:
+                # Keep serving the previous index
+                self.error = str(e)
+                logger.error(f"Knowledge reload failed: {e}")
+                return False
+        logger.info("Knowledge index reloaded")
+        return True
+
+    def _source_mtimes(self):
+        mtimes = {}
+        for path in self.watch_paths:
+            try:
+                mtimes[path] = os.path.getmtime(path)
+            except OSError:
+                mtimes[path] = None
+        return mtimes
+
+    async def watch_sources(self, interval=30):
+        """Poll the source files and reload the index when one changes.
+
+        With refresh_interval set the sources are also reloaded that often,
+        which picks up changes to the courses API; the index is only rebuilt
+        and swapped when the documents actually changed.
+        """
+        last_mtimes = self._source_mtimes()
+        last_refresh = time.monotonic()
+        while True:
+            await asyncio.sleep(interval)
+            mtimes = self._source_mtimes()
+            # Leave changes pending while the first build is still running
+            if not self.ready:
+                continue
+            if mtimes != last_mtimes:
+                logger.info("Knowledge sources changed, reloading index")
+            elif not self.refresh_interval or time.monotonic() - last_refresh < self.refresh_interval:
+                continue
+            if await self.reload():
+                last_mtimes = mtimes
+                last_refresh = time.monotonic()
+
+    def _retrieve(self, retriever, version, query, embedding=None, course_slug=None):
+        metadata_filter = course_scope_filter(course_slug) if course_slug else None
+        context_docs = retriever.search(query, embedding=embedding,
+                                        metadata_filter=metadata_filter)
+        self.cache.put(query, version, context_docs, scope=course_slug)
+        return context_docs
+
+    def _format_context(self, context_docs):
+        context, stats = assemble_context(context_docs)
+        if not context_docs:
+            metrics.increment("context.empty")
+        metrics.observe("context.chunks", stats["chunks"])
+        metrics.observe("context.tokens", stats["tokens"])
+        metrics.observe("context.tokens_saved", stats["tokens_saved"])
+        logger.info(
+            f"Context: {stats['chunks']} chunks -> {stats['passages']} passages, "
+            f"{stats['tokens']} tokens ({stats['tokens_saved']} saved)")
+        return context
+
+    def get_context(self, query, course_slug=None):
+        """Return the retrieved context for query, or the degraded context.
+
+        With course_slug only general chunks and that course's chunks are
+        searched, which keeps other courses out of the context.
+        """
+        retriever, version = self._active
+        if retriever is None:
+            return self.degraded_context
+        context_docs = self.cache.get(query, version, scope=course_slug)
+        if context_docs is None:
+            context_docs = self._retrieve(retriever, version, query, course_slug=course_slug)
+        return self._format_context(context_docs)
+
+    async def _aget_context(self, query, course_slug=None):
+        loop = asyncio.get_running_loop()
+        if self.batcher is None:
+            return await loop.run_in_executor(self._executor, self.get_context, query, course_slug)
+        retriever, version = self._active
+        context_docs = self.cache.get(query, version, scope=course_slug)
+        if context_docs is None and is_small_talk(query):
+            # Nothing to retrieve, so skip the embedding call too
+            context_docs = []
+        if context_docs is None:
+            embedding = await self.batcher.embed(query)
+            context_docs = await loop.run_in_executor(
+                self._executor, self._retrieve, retriever, version, query, embedding, course_slug)
+        return self._format_context(context_docs)
+
+    async def aget_context(self, query, course_slug=None, timeout=RETRIEVAL_TIMEOUT):
+        """Async get_context that never blocks the event loop.
+
+        The query embedding goes through the micro-batcher and the search runs
+        on the dedicated executor. If retrieval takes longer than timeout
+        seconds the degraded context is returned instead; work already handed
+        to the executor still completes and fills the caches for the next call.
+        """
+        if not self.ready:
+            return self.degraded_context
+        start = time.perf_counter()
+        try:
+            context = await asyncio.wait_for(self._aget_context(query, course_slug),
+                                             timeout=timeout)
+        except asyncio.TimeoutError:
+            metrics.increment("retrieval.timeouts")
+            logger.warning(f"Retrieval timed out after {timeout}s, answering without context")
+            return self.degraded_context
+        metrics.observe("retrieval.latency_ms", (time.perf_counter() - start) * 1000)
+        return context
@@ -0,0 +1,53 @@
+"""Offline embedding backend computed locally with NumPy.
+
+HashingEmbeddings maps the character n-grams of each word into a fixed number
+of buckets (the hashing trick) and L2-normalises the result. It needs no
+network or API key, is deterministic across processes and is fast enough to
+embed the whole knowledge base in milliseconds, which makes it suitable for
+CI, load tests and running without Google.
+"""
+import zlib
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from text_utils import words
+
+
+class HashingEmbeddings(Embeddings):
+    """Hashed character n-gram embeddings."""
+
+    def __init__(self, dimensions=512, min_n=3, max_n=5):
+        self.dimensions = dimensions
+        self.min_n = min_n
+        self.max_n = max_n
+
+    @property
+    def model_name(self):
+        return f"local-hashing-{self.dimensions}-{self.min_n}-{self.max_n}"
+
+    def _features(self, text):
+        for word in words(text):
+            padded = f" {word} "
+            # Whole words keep exact matches such as "mysql" strong
+            yield padded
+            for n in range(self.min_n, self.max_n + 1):
+                for i in range(len(padded) - n + 1):
+                    yield padded[i:i + n]
+
+    def _embed(self, text):
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for feature in self._features(text):
+            h = zlib.crc32(feature.encode("utf-8"))
+            # Signed hashing keeps collisions from always adding up
+            vector[h % self.dimensions] += 1.0 if (h >> 31) & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        return vector.tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
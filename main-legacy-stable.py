@@ -1,9 +1,5 @@
 import streamlit as st
-from langchain_community.vectorstores import Chroma, FAISS, Cassandra
 from langchain_groq import ChatGroq
-from langchain_community.document_loaders import WebBaseLoader, TextLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from langchain_core.prompts import (
     ChatPromptTemplate,
     MessagesPlaceholder,
@@ -16,6 +12,9 @@ from langchain_anthropic import ChatAnthropic
 from langchain_openai import ChatOpenAI
 from dotenv import load_dotenv
 import os
+from ingestion import create_knowledge_base
+from knowledge_index import get_embeddings
+from question_rewrite import contextualize
 
 load_dotenv()
 name = "Achelton"
@@ -58,19 +57,16 @@ examples = [
 
 
 ### Construct retriever ###
-loader = TextLoader("./cursos.txt", encoding="UTF-8")
+@st.cache_resource
+def load_knowledge():
+    """Build or load the shared knowledge index once per Streamlit server."""
+    embeddings, embedding_model = get_embeddings()
+    knowledge = create_knowledge_base(embeddings, embedding_model, k=10)
+    knowledge.build()
+    return knowledge
 
-docs = loader.load()
 
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-
-text_splitter = RecursiveCharacterTextSplitter(
-    chunk_size=1000, chunk_overlap=200, add_start_index=True
-)
-all_splits = text_splitter.split_documents(docs)
-embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
-vectorstore = FAISS.from_documents(documents=all_splits, embedding=embeddings)
-retriever = vectorstore.as_retriever(search_type="similarity", search_kwargs={"k": 10})
+retriever = load_knowledge().retriever
 
 contextualize_q_system_prompt = """Given a chat history and the latest user question \
 which might reference context in the chat history, formulate a standalone question \
@@ -85,16 +81,6 @@ contextualize_q_prompt = ChatPromptTemplate.from_messages(
     ]
 )
 contextualize_q_chain = contextualize_q_prompt | llm | StrOutputParser()
-
-contextualize_q_chain.invoke(
-    {
-        "chat_history": [
-            HumanMessage(content="What does LLM stand for?"),
-            AIMessage(content="Large language model"),
-        ],
-        "question": "What is meant by large?",
-    }
-)
 qa_system_prompt = """You are Ada, an exceptional AI sales representative for Buka, an edtech startup dedicated to transforming lives through education. Your persona blends the persuasive skills of Jordan Belfort, the inspirational approach of Simon Sinek, and the visionary spirit of Steve Jobs. Your task is to engage with potential customers and effectively sell courses.
 
 
@@ -331,10 +317,7 @@ def format_docs(docs):
 
 
 def contextualized_question(input: dict):
-    if input.get("chat_history"):
-        return contextualize_q_chain
-    else:
-        return input["question"]
+    return contextualize(contextualize_q_chain, input["question"], input.get("chat_history"))
 
 
 rag_chain = (
@@ -6,10 +6,6 @@ from langchain.tools import StructuredTool
 from pydantic import BaseModel, Field
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.messages import AIMessage, HumanMessage
-from langchain_community.document_loaders import TextLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from langchain_community.vectorstores import FAISS
 from langchain_groq import ChatGroq
 from langchain.callbacks import StreamlitCallbackHandler
 from langchain_anthropic import ChatAnthropic
@@ -17,6 +13,8 @@ from dotenv import load_dotenv
 import requests
 import os
 import json
+from ingestion import create_knowledge_base
+from knowledge_index import get_embeddings
 
 # Load environment variables
 load_dotenv()
@@ -94,14 +92,16 @@ tools = [get_courses, send_facebook_message, send_instagram_message, send_whatsa
 
 
 # Construct retriever
-loader = TextLoader("./rag.txt", encoding="UTF-8")
-docs = loader.load()
+@st.cache_resource
+def load_knowledge():
+    """Build or load the shared knowledge index once per Streamlit server."""
+    embeddings, embedding_model = get_embeddings()
+    knowledge = create_knowledge_base(embeddings, embedding_model, k=6)
+    knowledge.build()
+    return knowledge
 
-text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-all_splits = text_splitter.split_documents(docs)
-embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
-vectorstore = FAISS.from_documents(documents=all_splits, embedding=embeddings)
-retriever = vectorstore.as_retriever(search_type="similarity", search_kwargs={"k": 6})
+
+knowledge = load_knowledge()
 
 # Define response examples as a dictionary
 response_examples = [
@@ -398,8 +398,7 @@ for message in st.session_state.chat_history:
 user_query = st.chat_input("O que desejas saber?")
 if user_query is not None and user_query != "":
     # Retrieve relevant context
-    context_docs = retriever.get_relevant_documents(user_query)
-    context = "\n".join([doc.page_content for doc in context_docs])
+    context = knowledge.get_context(user_query)
 
     # Prepare the input for the agent
     agent_input = {
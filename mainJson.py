@@ -1,9 +1,5 @@
 import streamlit as st
-from langchain_community.vectorstores import Chroma, FAISS, Cassandra
 from langchain_groq import ChatGroq
-from langchain_community.document_loaders import WebBaseLoader, TextLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from langchain_core.prompts import (
     ChatPromptTemplate,
     MessagesPlaceholder,
@@ -16,6 +12,9 @@ from langchain_anthropic import ChatAnthropic
 from langchain_openai import ChatOpenAI
 from dotenv import load_dotenv
 import os
+from ingestion import create_knowledge_base
+from knowledge_index import get_embeddings
+from question_rewrite import contextualize, needs_contextualization, speculative_retrieval
 load_dotenv()
 name = "Achelton"
 # llm = ChatGroq(temperature=0, model_name="mixtral-8x7b-32768")
@@ -56,20 +55,16 @@ examples = [
 
 ### Construct retriever ###
 
-loader = WebBaseLoader("https://backend-produc.herokuapp.com/api/v1/cursos")
+@st.cache_resource
+def load_knowledge():
+    """Build or load the shared knowledge index once per Streamlit server."""
+    embeddings, embedding_model = get_embeddings()
+    knowledge = create_knowledge_base(embeddings, embedding_model, k=10)
+    knowledge.build()
+    return knowledge
 
-docs = loader.load()
 
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-
-text_splitter = RecursiveCharacterTextSplitter(
-    chunk_size=1000, chunk_overlap=200, add_start_index=True
-)
-
-all_splits = text_splitter.split_documents(docs)
-embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
-vectorstore = FAISS.from_documents(documents=all_splits, embedding=embeddings)
-retriever = vectorstore.as_retriever(search_type="similarity", search_kwargs={"k": 10})
+retriever = load_knowledge().retriever
 
 contextualize_q_system_prompt = """Given a chat history and the latest user question \
 which might reference context in the chat history, formulate a standalone question \
@@ -84,16 +79,6 @@ contextualize_q_prompt = ChatPromptTemplate.from_messages(
     ]
 )
 contextualize_q_chain = contextualize_q_prompt | llm | StrOutputParser()
-
-contextualize_q_chain.invoke(
-    {
-        "chat_history": [
-            HumanMessage(content="What does LLM stand for?"),
-            AIMessage(content="Large language model"),
-        ],
-        "question": "What is meant by large?",
-    }
-)
 qa_system_prompt = """You are Ada, an exceptional AI sales representative for Buka, an edtech startup dedicated to transforming lives through education. Your persona blends the persuasive skills of Jordan Belfort, the inspirational approach of Simon Sinek, and the visionary spirit of Steve Jobs. Your task is to engage with potential customers and effectively sell courses.
 
 
@@ -330,16 +315,21 @@ def format_docs(docs):
 
 
 def contextualized_question(input: dict):
-    if input.get("chat_history"):
-        return contextualize_q_chain
-    else:
-        return input["question"]
+    return contextualize(contextualize_q_chain, input["question"], input.get("chat_history"))
+
+
+def retrieve_context(input: dict):
+    """Retrieve for the question, overlapping retrieval with the rewrite."""
+    if not input.get("chat_history") or not needs_contextualization(input["question"]):
+        return format_docs(retriever.invoke(input["question"]))
+    _, docs = speculative_retrieval(retriever.invoke,
+                                    lambda: contextualized_question(input),
+                                    input["question"], input["chat_history"])
+    return format_docs(docs)
 
 
 rag_chain = (
-    RunnablePassthrough.assign(
-        context=contextualized_question | retriever | format_docs
-    )
+    RunnablePassthrough.assign(context=retrieve_context)
     | qa_prompt
     | llm
 )
@@ -0,0 +1,49 @@
+"""In-process counters and timings exposed by the apps' /metrics endpoint.
+
+Values are per worker process and reset on restart; they are meant for quick
+inspection and for scraping into a dashboard, not as a durable store.
+"""
+import threading
+from collections import defaultdict
+
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_observations = {}
+
+
+def increment(name, value=1):
+    """Add value to the counter called name."""
+    with _lock:
+        _counters[name] += value
+
+
+def observe(name, value):
+    """Record one sample (latency, size...) for the summary called name."""
+    with _lock:
+        summary = _observations.get(name)
+        if summary is None:
+            _observations[name] = {"count": 1, "sum": value, "min": value, "max": value}
+        else:
+            summary["count"] += 1
+            summary["sum"] += value
+            summary["min"] = min(summary["min"], value)
+            summary["max"] = max(summary["max"], value)
+
+
+def hit_rate(prefix):
+    """Return hits / (hits + misses) for the counters `<prefix>.hits|misses`."""
+    with _lock:
+        hits = _counters.get(f"{prefix}.hits", 0)
+        misses = _counters.get(f"{prefix}.misses", 0)
+    total = hits + misses
+    return hits / total if total else 0.0
+
+
+def snapshot():
+    """Return a JSON-serialisable copy of every counter and summary."""
+    with _lock:
+        observations = {
+            name: dict(summary, avg=summary["sum"] / summary["count"])
+            for name, summary in _observations.items()
+        }
+        return {"counters": dict(_counters), "observations": observations}
@@ -0,0 +1,154 @@
+"""Follow-up question rewriting for the Streamlit RAG chains.
+
+With chat history, the chains ask the LLM (contextualize_q_chain) to turn
+the latest question into a standalone one before retrieving. That is a full
+LLM round trip in front of retrieval. speculative_retrieval starts retrieving
+while the rewrite runs, on the question plus the customer's previous message,
+which is where a rewrite finds what "esse curso" or "E o de Excel?" refer
+to. It only retrieves again when the rewrite asks about words that query did
+not contain, so most turns pay for the rewrite alone instead of rewrite +
+retrieval.
+
+Most follow-ups need no rewrite at all: postback payloads and full
+sentences are already standalone. contextualize only calls the LLM when
+needs_contextualization finds a reference to earlier turns ("esse curso",
+"inscrevê-lo") or an elliptical question that names no subject ("quanto
+custa?"), and caches rewrites per (history tail, question).
+
+Outcomes are counted in `metrics` under `speculative_retrieval` (`saved_ms`
+is the retrieval time taken off the critical path) and `contextualize`.
+"""
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from cachetools import TTLCache
+
+import metrics
+from hybrid_retriever import PORTUGUESE_STOPWORDS, tokenize
+from retrieval_cache import QUERY_CACHE_SIZE, QUERY_CACHE_TTL, normalize_query
+from text_utils import words
+
+logger = logging.getLogger(__name__)
+
+# Messages of history that, with the question, key the rewrite cache
+REWRITE_HISTORY_TAIL = int(os.getenv("REWRITE_HISTORY_TAIL", "2"))
+
+# Demonstratives and pronouns pointing back at something said before; matched
+# on the unfolded text so "esta" (this) is not confused with "está" (is)
+REFERENCE_RE = re.compile(
+    r"\b(ess[ea]s?|est[ea]s?|isso|isto|aquel[ea]s?|aquilo|d?el[ea]s?|n[ea]l[ea]s?|"
+    r"dess[ea]s?|dest[ea]s?|disso|nisso|ness[ea]s?|nest[ea]s?|mesm[oa]s?)\b"
+    # Clitic pronouns: "inscrevê-lo", "comprá-la", "enviar-lhe"
+    r"|\w-(l[oa]s?|lhes?)\b",
+    re.IGNORECASE)
+# Questions opening with a connective continue the previous one ("E o de Excel?")
+CONTINUATION_RE = re.compile(r"^\s*(e|mas|entao|tambem|so)\b")
+# Words that ask about an attribute of something without naming it; a question
+# made only of these ("quanto custa?", "quando começa?") needs the history.
+# Singular "curso" counts, since "o curso" means the one being discussed
+ATTRIBUTE_WORDS = frozenset("""
+quanto quantos custa custam custo preco precos valor pagar pagamento prestacoes
+quando horario horarios hora horas data datas dia dias duracao dura inicio
+comeca termina fim onde local localizacao fica endereco requisito requisitos
+nivel vaga vagas curso formador professor certificado inscricao inscrever
+inscrevo matricula online presencial mais detalhe detalhes informacao
+informacoes conteudo programa modulo modulos link desconto funciona disponivel
+""".split())
+
+_rewrite_cache = TTLCache(maxsize=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL)
+_rewrite_lock = threading.Lock()
+
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="speculative")
+
+
+def needs_contextualization(question):
+    """True when question depends on earlier turns to be understood."""
+    if REFERENCE_RE.search(question.lower()):
+        return True
+    content = [word for word in words(question) if word not in PORTUGUESE_STOPWORDS]
+    if not content:
+        # Small talk retrieves nothing, so there is nothing to rewrite for
+        return False
+    if CONTINUATION_RE.match(" ".join(words(question))):
+        return True
+    return all(word in ATTRIBUTE_WORDS for word in content)
+
+
+def contextualize(rewrite_chain, question, chat_history):
+    """Return the standalone form of question, calling the LLM only if needed.
+
+    rewrite_chain takes {"question", "chat_history"} and returns the rewrite.
+    Rewrites are cached per last REWRITE_HISTORY_TAIL messages and question.
+    """
+    if not chat_history or not needs_contextualization(question):
+        metrics.increment("contextualize.skipped")
+        return question
+    key = (tuple(normalize_query(str(message.content)) for message in chat_history[-REWRITE_HISTORY_TAIL:]),
+           normalize_query(question))
+    with _rewrite_lock:
+        rewritten = _rewrite_cache.get(key)
+    if rewritten is not None:
+        metrics.increment("contextualize.cache_hits")
+        return rewritten
+    metrics.increment("contextualize.llm_calls")
+    rewritten = rewrite_chain.invoke({"question": question, "chat_history": chat_history})
+    with _rewrite_lock:
+        _rewrite_cache[key] = rewritten
+    return rewritten
+
+
+def speculative_query(question, chat_history=None):
+    """The question followed by the customer's previous message, if any.
+
+    A follow-up needing a rewrite leaves out what it is about, and the
+    rewrite takes it from the earlier turns, most often the customer's last
+    message; the assistant's replies are long and mention everything.
+    """
+    for message in reversed(chat_history or []):
+        if getattr(message, "type", None) == "human":
+            return f"{question} {message.content}"
+    return question
+
+
+def covers(query, rewritten):
+    """True when every content word of rewritten is also in query."""
+    return set(tokenize(rewritten)) <= set(tokenize(query))
+
+
+def _timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def speculative_retrieval(retrieve, rewrite, question, chat_history=None):
+    """Return (standalone_question, docs), retrieving while rewrite() runs.
+
+    retrieve(text) returns documents and rewrite() returns the standalone
+    question. The speculative documents, retrieved for speculative_query,
+    are kept when that query covers the rewrite; otherwise retrieval runs
+    again on the rewrite.
+    """
+    query = speculative_query(question, chat_history)
+    speculative = _executor.submit(_timed, retrieve, query)
+    rewritten, rewrite_ms = _timed(rewrite)
+    docs, retrieve_ms = speculative.result()
+    metrics.observe("speculative_retrieval.rewrite_ms", rewrite_ms)
+
+    if covers(query, rewritten):
+        # Sequentially the whole retrieval would have started after the
+        # rewrite; only the part that overlapped it was saved
+        saved_ms = min(retrieve_ms, rewrite_ms)
+        metrics.increment("speculative_retrieval.reused")
+        metrics.observe("speculative_retrieval.saved_ms", saved_ms)
+        logger.info(f"Reused speculative retrieval, saved {saved_ms:.0f} ms")
+        return rewritten, docs
+
+    metrics.increment("speculative_retrieval.rerun")
+    metrics.observe("speculative_retrieval.wasted_ms", retrieve_ms)
+    logger.info(f"Rewrite changed the question, retrieving again: {rewritten!r}")
+    return rewritten, retrieve(rewritten)
@@ -0,0 +1,103 @@
+"""Caches for repeated retrieval queries.
+
+A large share of the chat traffic is identical text: greetings, carousel
+postback payloads and quick-reply buttons. Two LRU+TTL caches avoid paying
+for them again:
+
+* CachedQueryEmbeddings memoizes query embeddings by normalized query text.
+* RetrievalCache memoizes retrieved documents by normalized query, index
+  version and search scope (e.g. the active course), so a rebuilt index never
+  serves results from the previous one.
+
+Hit and miss counts are recorded in `metrics` under `query_embedding_cache`
+and `retrieval_cache`.
+"""
+import inspect
+import os
+import threading
+
+from cachetools import TTLCache
+from langchain_core.embeddings import Embeddings
+
+import metrics
+
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "1024"))
+QUERY_CACHE_TTL = int(os.getenv("QUERY_CACHE_TTL", "3600"))
+
+
+def normalize_query(text):
+    """Collapse case and whitespace so trivially different prompts share a key."""
+    return " ".join(text.lower().split())
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """Embeddings wrapper that memoizes embed_query; documents pass through."""
+
+    def __init__(self, embeddings, maxsize=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL):
+        self.embeddings = embeddings
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts):
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text):
+        key = normalize_query(text)
+        with self._lock:
+            vector = self._cache.get(key)
+        if vector is not None:
+            metrics.increment("query_embedding_cache.hits")
+            return vector
+        metrics.increment("query_embedding_cache.misses")
+        vector = self.embeddings.embed_query(text)
+        with self._lock:
+            self._cache[key] = vector
+        return vector
+
+    def embed_queries(self, texts):
+        """Embed several queries at once, serving cached ones from memory."""
+        keys = [normalize_query(text) for text in texts]
+        with self._lock:
+            vectors = [self._cache.get(key) for key in keys]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        metrics.increment("query_embedding_cache.hits", len(texts) - len(missing))
+        metrics.increment("query_embedding_cache.misses", len(missing))
+        if missing:
+            # Go around the on-disk chunk cache: queries must not be persisted there
+            base = getattr(self.embeddings, "underlying_embeddings", self.embeddings)
+            batch = [texts[i] for i in missing]
+            if "task_type" in inspect.signature(base.embed_documents).parameters:
+                embedded = base.embed_documents(batch, task_type="retrieval_query")
+            else:
+                embedded = base.embed_documents(batch)
+            with self._lock:
+                for i, vector in zip(missing, embedded):
+                    vectors[i] = vector
+                    self._cache[keys[i]] = vector
+        return vectors
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+class RetrievalCache:
+    """LRU+TTL cache of retrieved documents keyed by query, index version and scope."""
+
+    def __init__(self, maxsize=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def get(self, query, version, scope=None):
+        with self._lock:
+            docs = self._cache.get((normalize_query(query), version, scope))
+        metrics.increment("retrieval_cache.hits" if docs is not None else "retrieval_cache.misses")
+        return docs
+
+    def put(self, query, version, docs, scope=None):
+        with self._lock:
+            self._cache[(normalize_query(query), version, scope)] = docs
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
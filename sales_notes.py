@@ -0,0 +1,125 @@
+"""Sales-funnel notes per subscriber, kept off the reply's critical path.
+
+Ada's replies used to carry `internal_notes` (funnel stage, customer
+insights, next steps) in the same JSON object as the messages, so every
+reply waited for the model to write notes the customer never sees. With
+INTERNAL_NOTES_MODE=background the reply prompt leaves them out and
+SalesNotes writes them afterwards: each exchange is queued, and a single
+worker turns it, together with the subscriber's previous notes, into updated
+notes using NOTES_MODEL (a cheaper model will do). Exchanges that pile up
+for a subscriber while the worker is busy are summarised in one call.
+
+In both modes the latest notes are kept per subscriber. Counts and timings
+are recorded in `metrics` under `sales_notes`.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+
+from cachetools import TTLCache
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# "inline": the reply JSON carries internal_notes; "background": SalesNotes writes them
+INTERNAL_NOTES_MODE = os.getenv("INTERNAL_NOTES_MODE", "inline")
+NOTES_MODEL = os.getenv("NOTES_MODEL", "gpt-4o-mini-2024-07-18")
+
+INTERNAL_NOTES_INSTRUCTIONS = (
+    "- `internal_notes`: Estágio do Funil de Vendas: [Current stage], Insights Importantes do "
+    "Cliente: [Key customer information], Próximos Passos: [Suggested follow-up actions]"
+)
+
+NOTES_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", """És analista de vendas da Buka, uma edtech que vende cursos. Com base nas notas anteriores sobre o cliente e nas últimas mensagens trocadas entre o cliente e a Ada, a assistente de vendas, escreve as notas internas atualizadas neste formato:
+
+Estágio do Funil de Vendas: [awareness, interest, consideration, intent, evaluation ou purchase]
+Insights Importantes do Cliente: [motivações, objetivos, objeções, cursos de interesse]
+Próximos Passos: [ações de seguimento sugeridas]
+
+Usa português de Portugal e responde apenas com as notas."""),
+    ("human", "Notas anteriores:\n{previous_notes}\n\nÚltimas mensagens:\n{exchanges}"),
+])
+
+
+def internal_notes_instructions():
+    """The reply prompt's line asking for internal_notes, empty in background mode."""
+    return INTERNAL_NOTES_INSTRUCTIONS if INTERNAL_NOTES_MODE == "inline" else ""
+
+
+def reply_text(output):
+    """The customer-facing text of a reply JSON: message texts and card titles."""
+    try:
+        messages = json.loads(output).get("messages", [])
+    except (ValueError, AttributeError):
+        return output
+    parts = []
+    for message in messages:
+        if not isinstance(message, dict):
+            continue
+        text = message.get("text") or message.get("value")
+        if message.get("type") == "text" and text:
+            parts.append(text)
+        parts.extend(element["title"] for element in message.get("elements", []) if element.get("title"))
+    return "\n".join(parts)
+
+
+class SalesNotes:
+    """Latest sales notes per subscriber, generated by a low-priority worker."""
+
+    def __init__(self, chain=None, maxsize=10000, ttl=24 * 3600):
+        self.notes = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._chain = chain
+        self._pending = {}
+        self._queue = asyncio.Queue()
+
+    def get(self, subscriber_id):
+        return self.notes.get(str(subscriber_id))
+
+    def record(self, subscriber_id, prompt, output):
+        """Keep the notes of one exchange: parsed from the reply, or queued for the worker."""
+        key = str(subscriber_id)
+        if INTERNAL_NOTES_MODE == "inline":
+            try:
+                notes = json.loads(output).get("internal_notes")
+            except (ValueError, AttributeError):
+                notes = None
+            if notes:
+                self.notes[key] = notes
+            return
+        if key in self._pending:
+            metrics.increment("sales_notes.coalesced")
+        else:
+            self._pending[key] = []
+            self._queue.put_nowait(key)
+        self._pending[key].append((prompt, reply_text(output)))
+
+    def _notes_chain(self):
+        if self._chain is None:
+            from langchain_openai import ChatOpenAI
+
+            self._chain = NOTES_PROMPT | ChatOpenAI(model=NOTES_MODEL, temperature=0) | StrOutputParser()
+        return self._chain
+
+    async def run(self):
+        """Write queued notes one subscriber at a time; start once per process."""
+        while True:
+            key = await self._queue.get()
+            exchanges = self._pending.pop(key)
+            start = time.perf_counter()
+            try:
+                self.notes[key] = await self._notes_chain().ainvoke({
+                    "previous_notes": self.notes.get(key, "(nenhumas)"),
+                    "exchanges": "\n\n".join(f"Cliente: {prompt}\nAda: {reply}" for prompt, reply in exchanges),
+                })
+            except Exception as e:
+                metrics.increment("sales_notes.failures")
+                logger.warning(f"Failed to write sales notes for {key}: {e}")
+                continue
+            metrics.increment("sales_notes.generated")
+            metrics.observe("sales_notes.latency_ms", (time.perf_counter() - start) * 1000)
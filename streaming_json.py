@@ -0,0 +1,122 @@
+"""Early delivery of reply messages while the model is still writing them.
+
+The agent answers with one JSON object, {"channel", "messages": [...],
+"internal_notes"}, and until now nothing was sent before the whole object was
+generated and parsed. MessageStreamParser reads the object as it streams in
+and hands over each element of "messages" as soon as its closing brace
+arrives, so deliver_stream can post the first bubble to ManyChat or
+BotConversa while the model is still writing the next ones and the
+internal notes.
+
+Timings are recorded in `metrics` under `streaming`.
+"""
+import json
+import logging
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class MessageStreamParser:
+    """Incremental parser for the elements of a top-level JSON array.
+
+    feed() takes the next piece of text and returns the array elements that
+    were completed by it. Only strings and nesting are tracked, which is all
+    it takes to find where each element starts and ends; every element is
+    then decoded with json.loads.
+    """
+
+    def __init__(self, key="messages"):
+        self.key = key
+        self.text = ""
+        self.messages_closed = False
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = None
+        self._last_key = None
+        self._in_array = False
+        self._element_start = None
+
+    def feed(self, chunk):
+        """Add chunk to the text and return the elements it completed."""
+        self.text += chunk
+        elements = []
+        text = self.text
+        while self._pos < len(text):
+            char = text[self._pos]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._depth == 1 and not self._in_array:
+                        self._last_key = json.loads(text[self._string_start:self._pos + 1])
+                    elif self._in_array and self._depth == 2:
+                        elements.append(json.loads(text[self._element_start:self._pos + 1]))
+                        self._element_start = None
+            elif char == '"':
+                self._in_string = True
+                self._string_start = self._pos
+                self._start_element()
+            elif char in "{[":
+                self._start_element()
+                self._depth += 1
+                if (char == "[" and self._depth == 2 and not self.messages_closed
+                        and self._last_key == self.key):
+                    self._in_array = True
+            elif char in "}]":
+                self._depth -= 1
+                if self._in_array and self._depth == 1:
+                    self._in_array = False
+                    self.messages_closed = True
+                elif self._in_array and self._depth == 2 and self._element_start is not None:
+                    elements.append(json.loads(text[self._element_start:self._pos + 1]))
+                    self._element_start = None
+            elif char == "," and self._depth == 1:
+                self._last_key = None
+            self._pos += 1
+        return elements
+
+    def _start_element(self):
+        if self._in_array and self._depth == 2 and self._element_start is None:
+            self._element_start = self._pos
+
+    def result(self):
+        """Decode the whole streamed object."""
+        return json.loads(self.text)
+
+
+async def deliver_stream(chunks, send, messages_sent=None):
+    """Send each message of a streamed reply as soon as it is complete.
+
+    chunks is an async iterable of the model's text and `await send(message)`
+    delivers one message. messages_sent, an asyncio.Event, is set once the
+    "messages" array has closed (or the stream ended), while the rest of the
+    object is still being generated. Returns the full text of the reply.
+    """
+    start = time.perf_counter()
+    parser = MessageStreamParser()
+    sent = 0
+    try:
+        async for chunk in chunks:
+            for message in parser.feed(chunk):
+                await send(message)
+                sent += 1
+                if sent == 1:
+                    metrics.observe("streaming.first_message_ms", (time.perf_counter() - start) * 1000)
+            if parser.messages_closed and messages_sent is not None and not messages_sent.is_set():
+                metrics.observe("streaming.messages_ms", (time.perf_counter() - start) * 1000)
+                messages_sent.set()
+    finally:
+        if messages_sent is not None:
+            messages_sent.set()
+    metrics.increment("streaming.messages", sent)
+    metrics.observe("streaming.total_ms", (time.perf_counter() - start) * 1000)
+    logger.info(f"Streamed {sent} messages in {(time.perf_counter() - start) * 1000:.0f} ms")
+    return parser.text
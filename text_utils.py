@@ -0,0 +1,16 @@
+"""Small text helpers shared by the retrieval modules."""
+import re
+import unicodedata
+
+WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def fold_accents(text):
+    """Lowercase text and strip diacritics ("Formação" -> "formacao")."""
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+def words(text):
+    """Split accent-folded text into word tokens."""
+    return WORD_RE.findall(fold_accents(text))
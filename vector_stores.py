@@ -0,0 +1,460 @@
+"""Vector store backends for the knowledge index.
+
+VECTOR_STORE (see knowledge_index) selects one of VECTOR_BACKENDS:
+
+* faiss   - LangChain FAISS (flat, IVF or HNSW, see ann_index)
+* chroma  - persistent Chroma collection (cosine HNSW)
+* numpy   - brute-force float32 NumPy matrix (QuantizedVectorStore)
+* float16 / int8 - the same matrix quantized, see below
+
+`build_vectorstore` writes a backend into a folder and `load_vectorstore`
+opens it again; every backend answers similarity_search_with_score(_by_vector)
+with a callable metadata filter, which is all HybridRetriever needs. Build
+time, memory, query latency and recall on our data are reported by:
+
+    python vector_stores.py benchmark
+
+QuantizedVectorStore is a compact store backed by a quantized, memory-mapped
+NumPy matrix.
+
+FAISS keeps a private float32 copy of every vector in each uvicorn worker and
+Streamlit session. QuantizedVectorStore stores the (L2-normalised) vectors as
+float16, or as int8 with one float32 scale per vector, in .npy files that are
+opened with mmap, so every process on the machine shares one physical copy
+through the page cache. Search is an exact brute-force inner product, which
+is still sub-millisecond for the few thousand chunks of the knowledge base.
+
+Scores are cosine similarities (higher is better), unlike FAISS' L2 distances.
+
+Compare rankings against an exact FAISS index on sample queries with:
+
+    python vector_stores.py compare --dtype int8
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from ann_index import INDEX_TYPE, apply_search_params, build_faiss_store
+from hybrid_retriever import FilterMasks
+
+VECTOR_BACKENDS = ("faiss", "chroma", "numpy", "float16", "int8")
+VECTORS_FILE = "vectors.npy"
+SCALES_FILE = "scales.npy"
+DOCUMENTS_FILE = "documents.json"
+CHROMA_COLLECTION = "knowledge"
+# Rows scored per step so int8/float16 blocks are upcast a slice at a time
+SEARCH_BLOCK_ROWS = 65536
+
+SAMPLE_QUERIES = [
+    "Olá",
+    "Quais são todos os cursos disponíveis?",
+    "Fale-me mais sobre o curso de PowerBI",
+    "Me fale mais sobre o Curso de Power BI (Business Intelligence)",
+    "Curso de base de dados com MySQL",
+    "Windows Server 2022",
+    "Como me inscrevo em um curso?",
+    "Como funciona o pagamento dos cursos?",
+    "Recebo algum certificado ao concluir um curso?",
+    "Quais são as redes sociais da Buka?",
+    "Como posso entrar em contato com a Buka?",
+    "Quanto custa o curso de recursos humanos?",
+]
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def quantize(vectors, dtype="float16"):
+    """Return (quantized, scales) for normalised float32 vectors."""
+    if dtype == "float16":
+        return vectors.astype(np.float16), None
+    if dtype == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        quantized = np.round(vectors / scales[:, None]).astype(np.int8)
+        return quantized, scales.astype(np.float32)
+    if dtype == "float32":
+        return vectors.astype(np.float32), None
+    raise ValueError(f"Unsupported vector dtype: {dtype}")
+
+
+class QuantizedVectorStore(VectorStore):
+    """Exact cosine search over quantized vectors that may be memory-mapped."""
+
+    def __init__(self, embedding, vectors, scales, documents):
+        self.embedding = embedding
+        self.vectors = vectors
+        self.scales = scales
+        self.documents = documents
+        self.masks = FilterMasks(documents)
+
+    @property
+    def embeddings(self):
+        return self.embedding
+
+    @property
+    def dtype(self):
+        return str(self.vectors.dtype)
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, dtype="float16", **kwargs):
+        metadatas = metadatas or [{} for _ in texts]
+        documents = [Document(page_content=text, metadata=metadata)
+                     for text, metadata in zip(texts, metadatas)]
+        vectors = _normalize(embedding.embed_documents(list(texts)))
+        quantized, scales = quantize(vectors, dtype)
+        return cls(embedding, quantized, scales, documents)
+
+    def add_texts(self, texts, metadatas=None, **kwargs):
+        """Append texts in memory; the mmap files are only written by save_local."""
+        texts = list(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        vectors = _normalize(self.embedding.embed_documents(texts))
+        quantized, scales = quantize(vectors, self.dtype)
+        start = len(self.documents)
+        self.vectors = np.concatenate([self.vectors, quantized])
+        if scales is not None:
+            self.scales = np.concatenate([self.scales, scales])
+        self.documents.extend(Document(page_content=text, metadata=metadata)
+                              for text, metadata in zip(texts, metadatas))
+        self.masks.clear()
+        return [str(i) for i in range(start, len(self.documents))]
+
+    def save_local(self, folder_path):
+        os.makedirs(folder_path, exist_ok=True)
+        np.save(os.path.join(folder_path, VECTORS_FILE), np.ascontiguousarray(self.vectors))
+        if self.scales is not None:
+            np.save(os.path.join(folder_path, SCALES_FILE), self.scales)
+        with open(os.path.join(folder_path, DOCUMENTS_FILE), "w", encoding="UTF-8") as f:
+            json.dump([{"page_content": doc.page_content, "metadata": doc.metadata}
+                       for doc in self.documents], f, ensure_ascii=False)
+
+    @classmethod
+    def load_local(cls, folder_path, embeddings, mmap=True):
+        """Open a saved store; vectors stay on disk and are paged in on demand."""
+        vectors = np.load(os.path.join(folder_path, VECTORS_FILE),
+                          mmap_mode="r" if mmap else None)
+        scales_path = os.path.join(folder_path, SCALES_FILE)
+        scales = np.load(scales_path) if os.path.exists(scales_path) else None
+        with open(os.path.join(folder_path, DOCUMENTS_FILE), encoding="UTF-8") as f:
+            documents = [Document(**doc) for doc in json.load(f)]
+        return cls(embeddings, vectors, scales, documents)
+
+    def _scores(self, query_vector):
+        scores = np.empty(len(self.documents), dtype=np.float32)
+        for start in range(0, len(self.documents), SEARCH_BLOCK_ROWS):
+            block = np.asarray(self.vectors[start:start + SEARCH_BLOCK_ROWS], dtype=np.float32)
+            scores[start:start + len(block)] = block @ query_vector
+        if self.scales is not None:
+            scores *= self.scales
+        return scores
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        """Top-k by cosine; filter(metadata) -> bool excludes chunks before ranking."""
+        if not self.documents:
+            return []
+        scores = self._scores(_normalize(embedding))
+        if filter is not None:
+            allowed = self.masks.get(filter)
+            scores[~allowed] = -np.inf
+            k = min(k, int(allowed.sum()))
+            if k == 0:
+                return []
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.documents[i], float(scores[i])) for i in top]
+
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k, **kwargs)]
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        return self.similarity_search_with_score_by_vector(self.embedding.embed_query(query), k, **kwargs)
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return self.similarity_search_by_vector(self.embedding.embed_query(query), k, **kwargs)
+
+    def _select_relevance_score_fn(self):
+        # Cosine similarity in [-1, 1] mapped to [0, 1]
+        return lambda score: (score + 1) / 2
+
+
+def _chroma_client(folder_path):
+    import chromadb
+    from chromadb.config import Settings
+
+    return chromadb.PersistentClient(path=folder_path, settings=Settings(anonymized_telemetry=False))
+
+
+class ChromaVectorStore(VectorStore):
+    """Persistent Chroma collection behind the interface HybridRetriever uses.
+
+    Chroma only filters on metadata equality, so callable filters are applied
+    to an over-fetched result. Scores are cosine similarities like
+    QuantizedVectorStore's.
+    """
+
+    def __init__(self, chroma):
+        self.chroma = chroma
+        self._documents = None
+
+    @property
+    def embeddings(self):
+        return self.chroma.embeddings
+
+    @property
+    def documents(self):
+        if self._documents is None:
+            stored = self.chroma.get(include=["documents", "metadatas"])
+            self._documents = [Document(page_content=text, metadata=metadata or {})
+                               for text, metadata in zip(stored["documents"], stored["metadatas"])]
+        return self._documents
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, persist_directory=None, **kwargs):
+        from langchain_chroma import Chroma
+
+        # Chroma rejects None metadata values; a missing key reads the same
+        metadatas = [{key: value for key, value in (metadata or {}).items() if value is not None}
+                     for metadata in (metadatas or [{} for _ in texts])]
+        chroma = Chroma.from_texts(list(texts), embedding, metadatas=metadatas,
+                                   collection_name=CHROMA_COLLECTION,
+                                   client=_chroma_client(persist_directory),
+                                   collection_metadata={"hnsw:space": "cosine"})
+        return cls(chroma)
+
+    @classmethod
+    def load_local(cls, folder_path, embeddings):
+        from langchain_chroma import Chroma
+
+        return cls(Chroma(collection_name=CHROMA_COLLECTION, embedding_function=embeddings,
+                          client=_chroma_client(folder_path),
+                          create_collection_if_not_exists=False))
+
+    def add_texts(self, texts, metadatas=None, **kwargs):
+        self._documents = None
+        return self.chroma.add_texts(texts, metadatas=metadatas, **kwargs)
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, filter=None, fetch_k=20, **kwargs):
+        results = self.chroma.similarity_search_by_vector_with_relevance_scores(
+            embedding, k=max(k, fetch_k) if filter is not None else k)
+        # Cosine distance to cosine similarity
+        scored = [(doc, 1.0 - distance) for doc, distance in results]
+        if filter is not None:
+            scored = [(doc, score) for doc, score in scored if filter(doc.metadata)]
+        return scored[:k]
+
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k, **kwargs)]
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        return self.similarity_search_with_score_by_vector(self.embeddings.embed_query(query), k, **kwargs)
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return self.similarity_search_by_vector(self.embeddings.embed_query(query), k, **kwargs)
+
+    def _select_relevance_score_fn(self):
+        return lambda score: (score + 1) / 2
+
+
+def build_vectorstore(backend, documents, embeddings, folder_path):
+    """Embed documents into backend and persist it under folder_path."""
+    if backend == "faiss":
+        vectorstore = build_faiss_store(documents, embeddings, INDEX_TYPE)
+        vectorstore.save_local(folder_path)
+    elif backend == "chroma":
+        vectorstore = ChromaVectorStore.from_documents(documents, embeddings,
+                                                       persist_directory=folder_path)
+    elif backend in VECTOR_BACKENDS:
+        dtype = "float32" if backend == "numpy" else backend
+        vectorstore = QuantizedVectorStore.from_documents(documents, embeddings, dtype=dtype)
+        vectorstore.save_local(folder_path)
+    else:
+        raise ValueError(f"Unknown vector store backend: {backend}")
+    return vectorstore
+
+
+def load_vectorstore(backend, folder_path, embeddings):
+    """Open a store written by build_vectorstore."""
+    if backend == "faiss":
+        from langchain_community.vectorstores import FAISS
+
+        vectorstore = FAISS.load_local(folder_path, embeddings, allow_dangerous_deserialization=True)
+        apply_search_params(vectorstore.index)
+        return vectorstore
+    if backend == "chroma":
+        return ChromaVectorStore.load_local(folder_path, embeddings)
+    if backend in VECTOR_BACKENDS:
+        return QuantizedVectorStore.load_local(folder_path, embeddings)
+    raise ValueError(f"Unknown vector store backend: {backend}")
+
+
+def compare_rankings(exact_store, candidate_store, queries, embeddings, k=6):
+    """Measure how far candidate_store's top-k drifts from exact_store's.
+
+    Returns the mean overlap@k (share of exact top-k found by the candidate)
+    and the share of queries whose top-1 result is identical.
+    """
+    overlaps = []
+    same_top1 = 0
+    for query in queries:
+        vector = embeddings.embed_query(query)
+        exact = [doc.page_content for doc in exact_store.similarity_search_by_vector(vector, k=k)]
+        candidate = [doc.page_content for doc in candidate_store.similarity_search_by_vector(vector, k=k)]
+        if not exact:
+            continue
+        # Sources may contain identical chunks, so compare distinct texts
+        overlaps.append(len(set(exact) & set(candidate)) / len(set(exact)))
+        same_top1 += bool(candidate) and candidate[0] == exact[0]
+    return {
+        "queries": len(overlaps),
+        "k": k,
+        "mean_overlap_at_k": sum(overlaps) / len(overlaps) if overlaps else 0.0,
+        "top1_agreement": same_top1 / len(overlaps) if overlaps else 0.0,
+    }
+
+
+class _PrecomputedEmbeddings(Embeddings):
+    """Serves vectors embedded up front, so benchmarks time only the stores."""
+
+    def __init__(self, vectors):
+        self.vectors = vectors
+
+    def embed_documents(self, texts):
+        return [self.vectors[text] for text in texts]
+
+    def embed_query(self, text):
+        return self.vectors[text]
+
+
+def _rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+def _folder_bytes(path):
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, names in os.walk(path) for name in names)
+
+
+def benchmark_backend(backend, documents, embeddings, query_vectors, exact, k=6, repeats=20):
+    """Build, reload and query one backend; exact holds the true top-k texts per query."""
+    folder = tempfile.mkdtemp(prefix=f"bench-{backend}-")
+    try:
+        start = time.perf_counter()
+        build_vectorstore(backend, documents, embeddings, folder)
+        build_seconds = time.perf_counter() - start
+
+        rss_before = _rss_bytes()
+        vectorstore = load_vectorstore(backend, folder, embeddings)
+        # Touch every page of lazily loaded stores before measuring
+        vectorstore.similarity_search_with_score_by_vector(query_vectors[0], k=k)
+        rss_delta = _rss_bytes() - rss_before
+
+        latencies = []
+        recalls = []
+        for vector, expected in zip(query_vectors, exact):
+            for _ in range(repeats):
+                start = time.perf_counter()
+                results = vectorstore.similarity_search_with_score_by_vector(vector, k=k)
+                latencies.append((time.perf_counter() - start) * 1000)
+            found = {doc.page_content for doc, _ in results}
+            recalls.append(len(found & expected) / len(expected))
+        return {
+            "backend": backend,
+            "build_seconds": round(build_seconds, 3),
+            "disk_bytes": _folder_bytes(folder),
+            "rss_delta_bytes": rss_delta,
+            "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+            "p99_ms": round(float(np.percentile(latencies, 99)), 3),
+            f"recall@{k}": round(float(np.mean(recalls)), 4),
+        }
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def _benchmark_command(args):
+    from ingestion import load_knowledge_documents
+    from knowledge_index import get_embeddings, split_documents
+
+    embeddings, embedding_model = get_embeddings()
+    splits = split_documents(load_knowledge_documents(args.sources), splitter="structured")
+    # Real questions and course names from the corpus plus the sample queries
+    queries = list(dict.fromkeys(
+        SAMPLE_QUERIES
+        + [doc.metadata["question"] for doc in splits if doc.metadata.get("question")]
+        + [doc.metadata["course_name"] for doc in splits if doc.metadata.get("course_name")]))
+    texts = [doc.page_content for doc in splits]
+    vectors = dict(zip(texts, embeddings.embed_documents(texts)))
+    vectors.update(zip(queries, embeddings.embed_queries(queries)))
+    precomputed = _PrecomputedEmbeddings(vectors)
+
+    matrix = _normalize([vectors[text] for text in texts])
+    query_vectors = [vectors[query] for query in queries]
+    exact = []
+    for vector in query_vectors:
+        top = np.argsort(-(matrix @ _normalize(vector)))[:args.k]
+        exact.append({texts[i] for i in top})
+
+    results = []
+    for backend in args.backends:
+        try:
+            results.append(benchmark_backend(backend, splits, precomputed, query_vectors, exact,
+                                             k=args.k, repeats=args.repeats))
+        except ImportError as e:
+            results.append({"backend": backend, "error": f"not installed: {e}"})
+    print(json.dumps({"embedding_model": embedding_model, "chunks": len(splits),
+                      "queries": len(queries), "results": results}, indent=2))
+
+
+def _compare_command(args):
+    from langchain_community.vectorstores import FAISS
+    from ingestion import load_knowledge_documents
+    from knowledge_index import get_embeddings, split_documents
+
+    embeddings, embedding_model = get_embeddings()
+    splits = split_documents(load_knowledge_documents(args.sources), splitter="structured")
+    exact = FAISS.from_documents(splits, embeddings)
+    quantized = QuantizedVectorStore.from_documents(splits, embeddings, dtype=args.dtype)
+    result = compare_rankings(exact, quantized, SAMPLE_QUERIES, embeddings, k=args.k)
+    result.update({
+        "embedding_model": embedding_model,
+        "dtype": args.dtype,
+        "chunks": len(splits),
+        "float32_bytes": int(exact.index.ntotal * exact.index.d * 4),
+        "quantized_bytes": int(quantized.vectors.nbytes
+                               + (quantized.scales.nbytes if quantized.scales is not None else 0)),
+    })
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Quantized vector store tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    compare = subparsers.add_parser("compare", help="compare rankings with exact FAISS search")
+    compare.add_argument("--dtype", choices=["float16", "int8"], default="float16")
+    compare.add_argument("--k", type=int, default=6)
+    compare.add_argument("--sources", nargs="+", default=None)
+    compare.set_defaults(func=_compare_command)
+    benchmark = subparsers.add_parser("benchmark", help="build time, memory, latency and recall per backend")
+    benchmark.add_argument("--backends", nargs="+", choices=VECTOR_BACKENDS, default=list(VECTOR_BACKENDS))
+    benchmark.add_argument("--k", type=int, default=6)
+    benchmark.add_argument("--repeats", type=int, default=20)
+    benchmark.add_argument("--sources", nargs="+", default=None)
+    benchmark.set_defaults(func=_benchmark_command)
+    args = parser.parse_args()
+    args.func(args)